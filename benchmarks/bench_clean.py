@@ -0,0 +1,111 @@
+"""
+Micro-benchmark del limpiador de HTML para Telegraph.
+
+Compara el camino anterior (html.parser + str(content) + limpieza en varias
+pasadas + html_to_nodes) con el actual (lxml + nodos de Telegraph en un solo
+recorrido) sobre páginas reales de relatos.
+
+Uso:
+    python benchmarks/bench_clean.py pagina1.html pagina2.html ...
+    python benchmarks/bench_clean.py --from-site 10     # descarga 10 relatos
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from telegraph.utils import html_to_nodes  # noqa: E402
+
+import extraction  # noqa: E402
+
+CONTENT_SELECTORS = [".entry-content", ".post-content", "article .content", "article"]
+
+
+def legacy_clean_html_for_telegraph(html: str) -> str:
+    """Versión anterior de bot.clean_html_for_telegraph, como referencia."""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup.select("script, style, .sharedaddy, .jp-relatedposts, ins, iframe, form, nav"):
+        tag.decompose()
+    for div in soup.find_all("div"): div.name = "p"
+    for span in soup.find_all("span"): span.unwrap()
+    allowed = {"p", "br", "strong", "em", "b", "i", "a", "ul", "ol", "li", "h3", "h4", "blockquote", "figure", "figcaption", "img"}
+    for tag in soup.find_all(True):
+        if tag.name not in allowed:
+            tag.unwrap()
+        else:
+            attrs = {}
+            if tag.name == "a" and tag.get("href"): attrs["href"] = tag["href"]
+            if tag.name == "img" and tag.get("src"): attrs["src"] = tag["src"]
+            tag.attrs = attrs
+    return str(soup).encode("utf-8").decode("utf-8")
+
+
+def select_content(soup):
+    for selector in CONTENT_SELECTORS:
+        content = soup.select_one(selector)
+        if content:
+            return content
+    return soup
+
+
+def legacy_path(html: str) -> list:
+    soup = BeautifulSoup(html, "html.parser")
+    return html_to_nodes(legacy_clean_html_for_telegraph(str(select_content(soup))))
+
+
+def current_path(html: str) -> list:
+    soup = BeautifulSoup(html, "lxml")
+    return extraction.clean_nodes_for_telegraph(select_content(soup))
+
+
+async def download_pages(count: int) -> list:
+    os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+    os.environ.setdefault("CHAT_ID", "0")
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost")
+    import bot
+
+    cat = next(iter(bot.CATEGORIES.values()))
+    domain = cat["url"].split("/")[2]
+    links = await bot.get_story_links_from_page(cat["url"], domain)
+    pages = [await bot.fetch_text(s["url"], encoding="utf-8") for s in links[:count]]
+    await bot.close_http()
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="páginas HTML guardadas")
+    parser.add_argument("--from-site", type=int, default=0, metavar="N", help="descargar N relatos del sitio")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.files:
+        with open(path, encoding="utf-8") as f:
+            pages.append(f.read())
+    if args.from_site:
+        pages += asyncio.run(download_pages(args.from_site))
+    if not pages:
+        parser.error("no hay páginas: pasa ficheros HTML o --from-site N")
+
+    differing = sum(legacy_path(p) != current_path(p) for p in pages)
+    if differing:
+        print(f"⚠️  {differing} páginas producen nodos distintos a la versión anterior")
+
+    total_kb = sum(len(p) for p in pages) / 1024
+    print(f"{len(pages)} páginas, {total_kb:.0f} KB en total, {args.repeat} repeticiones")
+    results = {}
+    for label, func in (("anterior", legacy_path), ("actual", current_path)):
+        seconds = min(timeit.repeat(lambda: [func(p) for p in pages], number=1, repeat=args.repeat))
+        results[label] = seconds
+        print(f"  {label:<9} {seconds * 1000 / len(pages):8.2f} ms/página")
+    print(f"  mejora    {results['anterior'] / results['actual']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Regresión y benchmark de la extracción de relatos (extraction.py).
+
+Con las páginas guardadas en benchmarks/fixtures/:
+  1. comprueba que título, fecha y contenido coinciden con expected.json;
+  2. mide el tiempo frente a la extracción anterior (html.parser, selectores
+     en texto y limpieza en varias pasadas).
+
+Uso:
+    python benchmarks/bench_extraction.py            # regresión + benchmark
+    python benchmarks/bench_extraction.py --update   # regenerar expected.json
+    python benchmarks/bench_extraction.py --save URL [URL ...]   # guardar páginas reales como fixtures
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(HERE, "fixtures")
+EXPECTED = os.path.join(FIXTURES, "expected.json")
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from telegraph.utils import html_to_nodes  # noqa: E402
+
+import extraction  # noqa: E402
+from bench_clean import legacy_clean_html_for_telegraph  # noqa: E402
+
+
+def legacy_extract(html: str) -> extraction.Story:
+    """Extracción tal como la hacía bot.py antes de este módulo."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    pub_date = ""
+    time_tag = soup.find("time")
+    if time_tag and time_tag.get("datetime"):
+        try:
+            pub_date = datetime.fromisoformat(time_tag["datetime"][:10]).strftime("%d/%m/%Y")
+        except Exception:
+            pass
+    if not pub_date and time_tag:
+        pub_date = time_tag.get_text(strip=True)
+    if not pub_date:
+        for selector in [".entry-date", ".post-date", ".published", ".date"]:
+            el = soup.select_one(selector)
+            if el:
+                pub_date = el.get_text(strip=True)
+                break
+
+    real_title = ""
+    for selector in [".entry-title", "h1.post-title", "h1", "title"]:
+        el = soup.select_one(selector)
+        if el:
+            real_title = el.get_text(strip=True)
+            for sep in [" – ", " | ", " - "]:
+                if sep in real_title:
+                    real_title = real_title.split(sep)[0].strip()
+            if real_title:
+                break
+
+    content = extraction.NO_CONTENT
+    for selector in [".entry-content", ".post-content", "article .content", "article"]:
+        el = soup.select_one(selector)
+        if el:
+            content = html_to_nodes(legacy_clean_html_for_telegraph(str(el)))
+            break
+    return extraction.Story(real_title, pub_date, content)
+
+
+def summary(story: extraction.Story) -> dict:
+    content = json.dumps(story.content, ensure_ascii=False, sort_keys=True)
+    return {
+        "title": story.title,
+        "pub_date": story.pub_date,
+        "content_sha1": hashlib.sha1(content.encode("utf-8")).hexdigest(),
+        "content_bytes": len(content),
+    }
+
+
+def load_fixtures() -> dict:
+    pages = {}
+    for name in sorted(os.listdir(FIXTURES)):
+        if name.endswith(".html"):
+            with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+                pages[name] = f.read()
+    return pages
+
+
+def save_pages(urls: list):
+    import httpx
+
+    for url in urls:
+        resp = httpx.get(url, follow_redirects=True, timeout=30)
+        resp.raise_for_status()
+        slug = urlsplit(url).path.strip("/").replace("/", "_") or "index"
+        path = os.path.join(FIXTURES, f"{slug}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(resp.text)
+        print(f"guardada {path}")
+
+
+def check(pages: dict) -> int:
+    with open(EXPECTED, encoding="utf-8") as f:
+        expected = json.load(f)
+    failures = 0
+    for name, html in pages.items():
+        story = extraction.extract_story(html)
+        problems = []
+        if name not in expected:
+            problems.append("sin entrada en expected.json (usa --update)")
+        elif summary(story) != expected[name]:
+            problems.append(f"esperado {expected[name]}, obtenido {summary(story)}")
+        failures += bool(problems)
+        print(f"{'✗' if problems else '✓'} {name}")
+        for problem in problems:
+            print(f"    {problem}")
+    return failures
+
+
+def bench(pages: dict, repeat: int):
+    total_kb = sum(len(p) for p in pages.values()) / 1024
+    print(f"\n{len(pages)} páginas, {total_kb:.0f} KB en total, {repeat} repeticiones")
+    results = {}
+    for label, func in (("anterior", legacy_extract), ("actual", extraction.extract_story)):
+        seconds = min(timeit.repeat(lambda: [func(p) for p in pages.values()], number=1, repeat=repeat))
+        results[label] = seconds
+        print(f"  {label:<9} {seconds * 1000 / len(pages):8.2f} ms/página")
+    print(f"  mejora    {results['anterior'] / results['actual']:8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--update", action="store_true", help="regenerar expected.json")
+    parser.add_argument("--save", nargs="+", metavar="URL", help="descargar páginas como fixtures")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.save)
+        return
+    pages = load_fixtures()
+    if args.update:
+        expected = {name: summary(extraction.extract_story(html)) for name, html in pages.items()}
+        with open(EXPECTED, "w", encoding="utf-8") as f:
+            json.dump(expected, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"expected.json actualizado ({len(expected)} páginas)")
+        return
+
+    failures = check(pages)
+    bench(pages, args.repeat)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+"""
+Benchmark de extremo a extremo del bot sin salir de la máquina.
+
+Levanta en un proceso aparte un servidor HTTP local que hace de:
+  • sitio WordPress: listados paginados por categoría y páginas de relato
+    del tamaño indicado (con ETag, así que también se ejercita el GET
+    condicional);
+  • API de Telegraph (createAccount, createPage, editPage);
+  • Bot API de Telegram (getMe, sendMessage, editMessageText).
+
+MongoDB es mongomock (en memoria) o, con --mongo-uri, una base real
+(se usa la base `relatos_bench`, que se borra al empezar). Todas las
+operaciones sobre colecciones pasan por un proxy que las cuenta.
+
+Escenarios:
+  ciclo inicial     todas las historias son nuevas
+  ciclo sin cambios el sitio no ha cambiado (listados con 304)
+  ciclo incremental aparecen --new relatos nuevos por categoría, --reposts
+                    de ellos con el texto de un relato ya publicado
+  limpieza          clean_html_for_telegraph / extract_story por página
+  índice            build_index_summary + texto de cada categoría
+
+Para cada uno se informa de relatos/s, consultas a MongoDB por relato,
+llamadas a Telegraph/Telegram, memoria pico y el retraso máximo del bucle
+asyncio (lo que tardaría en atenderse un comando durante el ciclo).
+
+Uso:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --categories 7 --pages 5 --story-kb 60
+    python benchmarks/bench_pipeline.py --trace-memory --json resultados.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import Request, urlopen
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "noche verano jardín estrellas luminosa hablábamos viaje llegamos mirar "
+    "pasado dejado sentamos grande mientras cuando todo ella él nos que de en "
+    "lo las con era habíamos atrás casa ventana lluvia camino recuerdo"
+).split()
+
+
+# ══════════════════════════════════════════════
+# SERVIDOR FALSO (proceso aparte)
+# ══════════════════════════════════════════════
+
+class FakeSite:
+    """Estado del sitio falso: relatos por categoría, del más nuevo al más antiguo."""
+
+    def __init__(self, categories: int, pages: int, per_page: int, story_kb: int):
+        self.per_page = per_page
+        self.story_kb = story_kb
+        self.next_id = 0
+        self.stories = {}
+        for i in range(categories):
+            ids = [self._new_id() for _ in range(pages * per_page)]
+            self.stories[f"cat{i}"] = ids[::-1]
+        self.counts = Counter()
+        self.pages_cache = {}
+        self.reposts = {}
+
+    def _new_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def add(self, count: int, reposts: int = 0):
+        """Añade `count` relatos por categoría; `reposts` de ellos copian el texto de uno antiguo."""
+        for slug, ids in self.stories.items():
+            new = [self._new_id() for _ in range(count)]
+            for n, old in zip(new, random.Random(count).sample(ids, min(reposts, count, len(ids)))):
+                self.reposts[n] = old
+            self.stories[slug] = new[::-1] + ids
+
+    def listing(self, base: str, slug: str, page: int) -> str:
+        ids = self.stories[slug][(page - 1) * self.per_page:page * self.per_page]
+        articles = "".join(
+            f'<article class="post-{n} post"><header class="entry-header">'
+            f'<h2 class="entry-title"><a href="{base}/relato-{slug}-{n}/" rel="bookmark">'
+            f"Relato de prueba número {n}</a></h2></header>"
+            f'<div class="entry-summary"><p>{self._words(n, 40)}</p></div>'
+            f'<a class="more-link" href="{base}/relato-{slug}-{n}/">Leer más</a>'
+            f'<a href="{base}/relato-{slug}-{n}/#comments">0 comentarios</a></article>'
+            for n in ids
+        ) or '<section class="no-results"><h1 class="page-title">Nada encontrado</h1></section>'
+        return self._layout(f"Categoría {slug}", articles)
+
+    def story(self, slug: str, n: int) -> str:
+        key = (slug, n)
+        if key not in self.pages_cache:
+            rnd = random.Random(self.reposts.get(n, n))
+            paragraphs, size = [], 0
+            while size < self.story_kb * 1024:
+                text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(40, 120))).capitalize()
+                if rnd.random() < 0.3:
+                    text = text.replace(" ", ' <span style="color:#333">', 1) + "</span>"
+                if rnd.random() < 0.2:
+                    text = f"<strong>{text}</strong>"
+                paragraphs.append(f"<p>{text}.</p>")
+                size += len(paragraphs[-1])
+            body = (
+                f'<article id="post-{n}" class="post-{n} post type-post status-publish">'
+                f'<header class="entry-header"><h1 class="entry-title">Relato de prueba número {n}</h1>'
+                f'<div class="entry-meta"><time class="entry-date published" '
+                f'datetime="2024-05-{n % 28 + 1:02d}T21:15:00+00:00">fecha</time></div></header>'
+                f'<div class="entry-content">{"".join(paragraphs)}'
+                f'<div class="sharedaddy"><h3>Compartir</h3></div>'
+                f'<script>var ad = {n};</script><ins class="adsbygoogle"></ins></div></article>'
+            )
+            self.pages_cache[key] = self._layout(f"Relato de prueba número {n} – Sitio de prueba", body)
+        return self.pages_cache[key]
+
+    @staticmethod
+    def _words(seed: int, count: int) -> str:
+        rnd = random.Random(seed)
+        return " ".join(rnd.choice(WORDS) for _ in range(count))
+
+    @staticmethod
+    def _layout(title: str, main: str) -> str:
+        return (
+            '<!DOCTYPE html><html lang="es"><head><meta charset="UTF-8">'
+            f"<title>{title}</title><script>var wpData = {{}};</script></head>"
+            '<body><header class="site-header"><nav class="main-navigation"><ul>'
+            '<li><a href="/">Inicio</a></li></ul></nav></header>'
+            f'<main id="main">{main}</main><footer class="site-footer">Pie</footer></body></html>'
+        )
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    site: FakeSite = None
+
+    def do_GET(self):
+        site = self.site
+        path = urlsplit(self.path).path
+        base = f"http://{self.headers['Host']}"
+        parts = [p for p in path.split("/") if p]
+        if path == "/__stats":
+            return self._send(200, json.dumps(site.counts), "application/json")
+        site.counts["http_get"] += 1
+        if parts[:2] == ["category", "relatos-eroticos"] and len(parts) >= 3 and parts[2] in site.stories:
+            page = int(parts[4]) if len(parts) >= 5 and parts[3] == "page" else 1
+            return self._send_html(site.listing(base, parts[2], page))
+        if len(parts) == 1 and parts[0].startswith("relato-"):
+            _, slug, n = parts[0].split("-")
+            return self._send_html(site.story(slug, int(n)))
+        self._send(404, "Not found", "text/plain")
+
+    def do_POST(self):
+        site = self.site
+        path = urlsplit(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        parts = [p for p in path.split("/") if p]
+        if path == "/__add":
+            params = parse_qs(body.decode())
+            site.add(int(params["count"][0]), int(params["reposts"][0]))
+            return self._send(200, "{}", "application/json")
+        if parts and parts[0] == "telegraph":
+            return self._telegraph(parts[1], parts[2] if len(parts) > 2 else "")
+        if parts and parts[0].startswith("bot"):
+            return self._bot_api(parts[1])
+        self._send(404, "Not found", "text/plain")
+
+    def _telegraph(self, method: str, path: str):
+        site = self.site
+        site.counts[f"telegraph_{method}"] += 1
+        if method == "createAccount":
+            result = {"short_name": "bench", "author_name": "", "access_token": "bench-token"}
+        elif method == "createPage":
+            path = f"Relato-{site.counts['telegraph_createPage']}"
+            result = {"path": path, "url": f"https://telegra.ph/{path}"}
+        else:
+            result = {"path": path, "url": f"https://telegra.ph/{path}"}
+        self._send(200, json.dumps({"ok": True, "result": result}), "application/json")
+
+    def _bot_api(self, method: str):
+        site = self.site
+        site.counts[f"telegram_{method}"] += 1
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = {
+                "message_id": site.counts["telegram_sendMessage"],
+                "date": int(time.time()),
+                "chat": {"id": 0, "type": "channel", "title": "Bench"},
+                "text": "",
+            }
+        else:
+            result = True
+        self._send(200, json.dumps({"ok": True, "result": result}), "application/json")
+
+    def _send_html(self, html: str):
+        etag = '"' + hashlib.md5(html.encode()).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.site.counts["http_304"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._send(200, html, "text/html; charset=UTF-8", {"ETag": etag})
+
+    def _send(self, status: int, body: str, content_type: str, headers: dict | None = None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(conn, categories: int, pages: int, per_page: int, story_kb: int):
+    FakeHandler.site = FakeSite(categories, pages, per_page, story_kb)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHandler)
+    server.daemon_threads = True
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+
+def fake_stats(base: str) -> Counter:
+    with urlopen(f"{base}/__stats") as resp:
+        return Counter(json.load(resp))
+
+
+def fake_add(base: str, count: int, reposts: int):
+    urlopen(Request(f"{base}/__add", data=f"count={count}&reposts={reposts}".encode(), method="POST")).read()
+
+
+# ══════════════════════════════════════════════
+# MONGODB CON CONTADOR DE CONSULTAS
+# ══════════════════════════════════════════════
+
+class CountingCollection:
+    def __init__(self, collection, counts: Counter):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._counts[f"{self._collection.name}.{name}"] += 1
+            return attr(*args, **kwargs)
+        return call
+
+
+class CountingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self.counts = Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if hasattr(attr, "find_one"):
+            return CountingCollection(attr, self.counts)
+        return attr
+
+    def __getitem__(self, name):
+        return CountingCollection(self._db[name], self.counts)
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+def open_database(mongo_uri: str | None):
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+        client.drop_database("relatos_bench")
+        return client["relatos_bench"], "MongoDB"
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("Hace falta mongomock (pip install mongomock) o --mongo-uri mongodb://...")
+    return mongomock.MongoClient()["relatos_bench"], "mongomock"
+
+
+# ══════════════════════════════════════════════
+# BENCHMARK
+# ══════════════════════════════════════════════
+
+def load_bot(base: str, cache_dir: str):
+    """Importa bot.py apuntando al servidor falso."""
+    os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+    os.environ.setdefault("CHAT_ID", "0")
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost")
+    os.environ["HTTP_CACHE_DIR"] = cache_dir
+    os.environ["HTTP_HOST_DELAY"] = "0"
+    os.environ["TELEGRAPH_RATE"] = "1000"
+    os.environ["TELEGRAM_RATE"] = "1000"
+    import bot
+    from telegraph.api import TelegraphApi
+    from telegraph.exceptions import TelegraphException
+
+    def method(self, method, values=None, path=""):
+        values = values.copy() if values is not None else {}
+        if "access_token" not in values and self.access_token:
+            values["access_token"] = self.access_token
+        response = self.session.post(f"{base}/telegraph/{method}/{path}", values).json()
+        if response.get("ok"):
+            return response["result"]
+        raise TelegraphException(response.get("error"))
+
+    TelegraphApi.method = method
+    return bot
+
+
+class Measure:
+    """Mide tiempo, memoria, consultas y llamadas a las APIs falsas de un bloque."""
+
+    def __init__(self, bot, db: CountingDatabase, base: str, trace_memory: bool):
+        self.bot, self.db, self.base, self.trace_memory = bot, db, base, trace_memory
+
+    def __enter__(self):
+        self.queries = self.db.total()
+        self.published = self.db._db.published.count_documents({})
+        self.duplicates = self.db._db.published.count_documents({"duplicate_of": {"$exists": True}})
+        self.api = fake_stats(self.base)
+        if self.trace_memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        self.peak_mb = None
+        if self.trace_memory:
+            self.peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        self.rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.queries = self.db.total() - self.queries
+        self.stories = self.db._db.published.count_documents({}) - self.published
+        self.duplicates = self.db._db.published.count_documents({"duplicate_of": {"$exists": True}}) - self.duplicates
+        self.api = fake_stats(self.base) - self.api
+
+    def result(self) -> dict:
+        return {
+            "seconds": round(self.seconds, 3),
+            "stories": self.stories,
+            "duplicates": self.duplicates,
+            "stories_per_second": round(self.stories / self.seconds, 2) if self.stories else None,
+            "queries": self.queries,
+            "queries_per_story": round(self.queries / self.stories, 2) if self.stories else None,
+            "http_get": self.api["http_get"],
+            "http_304": self.api["http_304"],
+            "telegraph_calls": sum(v for k, v in self.api.items() if k.startswith("telegraph_")),
+            "telegram_calls": sum(v for k, v in self.api.items() if k.startswith("telegram_")),
+            "peak_python_mb": round(self.peak_mb, 1) if self.peak_mb is not None else None,
+            "max_rss_mb": round(self.rss_mb, 1),
+        }
+
+
+async def bench_cycles(bot, db, base: str, args) -> dict:
+    from telegram import Bot
+
+    tg = Bot(os.environ["TELEGRAM_TOKEN"], base_url=f"{base}/bot")
+    await tg.initialize()
+    results = {}
+    try:
+        for name, label, new in (("cold", "ciclo inicial", 0), ("warm", "ciclo sin cambios", 0),
+                                 ("incremental", "ciclo incremental", args.new)):
+            if new:
+                fake_add(base, new, args.reposts)
+            lag = []
+            monitor = asyncio.create_task(monitor_loop_lag(lag))
+            with Measure(bot, db, base, args.trace_memory) as m:
+                await bot.check_and_publish(tg)
+            monitor.cancel()
+            results[name] = {**m.result(), "max_loop_lag_ms": round(max(lag, default=0) * 1000, 1)}
+            print_result(label, results[name])
+    finally:
+        if bot._index_task:
+            bot._index_task.cancel()
+        await tg.shutdown()
+        await bot.close_http()
+    return results
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01):
+    """Retraso con el que el bucle despierta a una tarea: lo que esperaría un comando del bot."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+def bench_cleaner(bot, base: str, args) -> dict:
+    import extraction
+    from bs4 import BeautifulSoup
+
+    slugs = list(bot.CATEGORIES)
+    urls = [f"{base}/relato-{slugs[0]}-{n}/" for n in range(1, args.sample + 1)]
+    pages = [urlopen(url).read() for url in urls]
+    contents = [BeautifulSoup(p, "lxml").select_one(".entry-content") for p in pages]
+
+    def per_page(func, items) -> float:
+        best = min(timeit_once(func, items) for _ in range(args.repeat))
+        return best * 1000 / len(items)
+
+    results = {
+        "pages": len(pages),
+        "page_kb": round(sum(map(len, pages)) / len(pages) / 1024, 1),
+        "clean_ms_per_page": round(per_page(extraction.clean_html_for_telegraph, contents), 3),
+        "extract_story_ms_per_page": round(per_page(lambda p: extraction.extract_story(p, "utf-8"), pages), 3),
+    }
+    print(f"\nlimpieza ({results['pages']} páginas de {results['page_kb']} KB)")
+    print(f"  clean_html_for_telegraph {results['clean_ms_per_page']:8.2f} ms/página")
+    print(f"  extract_story            {results['extract_story_ms_per_page']:8.2f} ms/página")
+    return results
+
+
+def timeit_once(func, items) -> float:
+    started = time.perf_counter()
+    for item in items:
+        func(item)
+    return time.perf_counter() - started
+
+
+def bench_index(bot, db: CountingDatabase) -> dict:
+    def build():
+        bot.build_index_summary()
+        for cat_id in bot.CATEGORIES:
+            bot.get_category_page(cat_id)
+
+    results = {}
+    for name, label, invalidate in (("cold", "sin caché", True), ("cached", "con caché", False)):
+        if invalidate:
+            bot.invalidate_category_counts()
+            bot.invalidate_latest()
+        queries = db.total()
+        started = time.perf_counter()
+        build()
+        results[name] = {
+            "ms": round((time.perf_counter() - started) * 1000, 3),
+            "queries": db.total() - queries,
+        }
+    print("\níndice (resumen + texto de cada categoría)")
+    for name, label in (("cold", "sin caché"), ("cached", "con caché")):
+        print(f"  {label:<10} {results[name]['ms']:8.2f} ms, {results[name]['queries']} consultas")
+    return results
+
+
+def print_result(label: str, r: dict):
+    rate = f"{r['stories_per_second']:.1f} relatos/s" if r["stories_per_second"] else "sin relatos nuevos"
+    memory = f", pico Python {r['peak_python_mb']} MB" if r["peak_python_mb"] is not None else ""
+    duplicates = f", {r['duplicates']} enlazados como duplicados" if r["duplicates"] else ""
+    print(f"\n{label}: {r['stories']} relatos en {r['seconds']:.2f}s ({rate}){duplicates}")
+    per_story = f" ({r['queries_per_story']} por relato)" if r["queries_per_story"] is not None else ""
+    print(f"  MongoDB   {r['queries']} consultas{per_story}")
+    print(f"  HTTP      {r['http_get']} GET ({r['http_304']} con 304)")
+    print(f"  APIs      {r['telegraph_calls']} llamadas a Telegraph, {r['telegram_calls']} a Telegram")
+    print(f"  memoria   RSS máx. {r['max_rss_mb']} MB{memory}")
+    print(f"  bucle     retraso máx. {r['max_loop_lag_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--categories", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=3, help="páginas de listado por categoría")
+    parser.add_argument("--per-page", type=int, default=10, help="relatos por página de listado")
+    parser.add_argument("--story-kb", type=int, default=20, help="tamaño aproximado de cada relato")
+    parser.add_argument("--new", type=int, default=5, help="relatos nuevos por categoría en el ciclo incremental")
+    parser.add_argument("--reposts", type=int, default=1, help="cuántos de los nuevos son reediciones de uno antiguo")
+    parser.add_argument("--sample", type=int, default=20, help="páginas para medir la limpieza")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mongo-uri", help="usar MongoDB real en vez de mongomock")
+    parser.add_argument("--trace-memory", action="store_true", help="medir el pico de memoria con tracemalloc (más lento)")
+    parser.add_argument("--json", metavar="FICHERO", help="guardar los resultados para comparar entre versiones")
+    parser.add_argument("--verbose", action="store_true", help="mostrar el log del bot")
+    args = parser.parse_args()
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=serve, args=(child, args.categories, args.pages, args.per_page, args.story_kb), daemon=True)
+    server.start()
+    base = f"http://127.0.0.1:{parent.recv()}"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bot = load_bot(base, cache_dir)
+        if not args.verbose:
+            logging.getLogger(bot.__name__).setLevel(logging.WARNING)
+        if args.pages > bot.MAX_PAGES:
+            parser.error(f"--pages no puede superar MAX_PAGES ({bot.MAX_PAGES})")
+
+        raw_db, backend = open_database(args.mongo_uri)
+        db = bot._db = CountingDatabase(raw_db)
+        bot.CATEGORIES.clear()
+        for i in range(args.categories):
+            bot.CATEGORIES[f"cat{i}"] = {
+                "name": f"Categoría {i}", "url": f"{base}/category/relatos-eroticos/cat{i}/"}
+        bot.ensure_indexes()
+        bot.get_published_urls()
+
+        total = args.categories * args.pages * args.per_page
+        print(f"{backend}, {args.categories} categorías × {args.pages} páginas × {args.per_page} "
+              f"relatos ({total}), ~{args.story_kb} KB por relato")
+        results = {
+            "params": {k: v for k, v in vars(args).items() if k not in ("json", "verbose", "mongo_uri")},
+            "backend": backend,
+        }
+        results["cycles"] = asyncio.run(bench_cycles(bot, db, base, args))
+        results["cleaner"] = bench_cleaner(bot, base, args)
+        results["index"] = bench_index(bot, db)
+        results["queries_by_operation"] = dict(db.counts.most_common())
+
+    server.terminate()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,20 +7,45 @@ Bot de Telegram - Relatos eróticos multi-categoría
 """
 
 import asyncio
+import functools
+import hashlib
+import hmac
+import html
+import json
 import logging
+import multiprocessing
 import os
 import re
+import signal
+import socket
 import threading
-from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
-
-import requests
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+import httpx
 from bs4 import BeautifulSoup
+from bson import ObjectId
 from telegraph import Telegraph
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegraph.exceptions import TelegraphException
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from telegram.error import BadRequest
-from pymongo import MongoClient
+from telegram.error import BadRequest, NetworkError, RetryAfter
+import pymongo
+from pymongo import ASCENDING, DESCENDING, TEXT, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+
+from extraction import (
+    analyze_story, extract_title, fold_text, hamming_distance, simhash_bands,
+)
 
 # ─────────────────────────────────────────────
 # CONFIGURACIÓN
@@ -30,8 +55,51 @@ CHAT_ID          = os.environ["CHAT_ID"]
 MONGO_URI        = os.environ["MONGO_URI"]
 TELEGRAPH_AUTHOR = os.getenv("TELEGRAPH_AUTHOR", "Mi Canal")
 INTERVAL_HOURS   = int(os.getenv("INTERVAL_HOURS", "12"))
+POLL_MIN_HOURS   = float(os.getenv("POLL_MIN_HOURS", "1"))
+POLL_MAX_HOURS   = float(os.getenv("POLL_MAX_HOURS", "72"))
+SCHEDULER_TICK_SECONDS = 300
 MAX_PAGES        = 10
 MAX_CONTENT_SIZE = 30000
+NAV_RESERVE      = 500
+CATEGORY_PAGE_SIZE = 25
+SEARCH_PAGE_SIZE = 10
+HTTP_TIMEOUT     = 15
+HTTP_HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", "4"))
+HTTP_HOST_DELAY       = float(os.getenv("HTTP_HOST_DELAY", "1"))
+HTTP_CACHE_DIR        = os.getenv("HTTP_CACHE_DIR", ".http_cache")
+HTTP_CACHE_MAX_MB     = int(os.getenv("HTTP_CACHE_MAX_MB", "200"))
+FETCH_WORKERS         = int(os.getenv("FETCH_WORKERS", "4"))
+PUBLISH_WORKERS       = int(os.getenv("PUBLISH_WORKERS", "2"))
+# Procesos de parseo; por defecto uno por núcleo libre (0 = en el hilo del bot)
+PARSE_WORKERS         = int(os.getenv("PARSE_WORKERS", str(min(max((os.cpu_count() or 1) - 1, 0), 2))))
+PIPELINE_QUEUE_SIZE   = 50
+TELEGRAPH_RATE        = float(os.getenv("TELEGRAPH_RATE", "0.5"))   # llamadas por segundo
+TELEGRAM_RATE         = float(os.getenv("TELEGRAM_RATE", "0.33"))
+API_MAX_RETRIES       = 5
+JOB_LEASE_SECONDS     = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS      = 5
+JOB_RETRY_HOURS       = float(os.getenv("JOB_RETRY_HOURS", "24"))   # espera antes de reintentar un trabajo fallido
+JOB_RETENTION_DAYS    = 30
+WORKER_ID             = f"{socket.gethostname()}:{os.getpid()}"
+MAINTENANCE_BATCH       = 100
+MAINTENANCE_CONCURRENCY = int(os.getenv("MAINTENANCE_CONCURRENCY", "4"))
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", "60"))
+DIGEST_MODE           = os.getenv("DIGEST_MODE", "").lower() in ("1", "true", "yes")
+DIGEST_FLUSH_SECONDS  = float(os.getenv("DIGEST_FLUSH_SECONDS", "60"))
+DB_BATCH_SIZE         = int(os.getenv("DB_BATCH_SIZE", "50"))
+SIMHASH_MAX_DISTANCE  = int(os.getenv("SIMHASH_MAX_DISTANCE", "3"))   # bits; más de 3 no garantiza coincidir en una banda
+HEALTH_PORT           = int(os.getenv("HEALTH_PORT", os.getenv("PORT", "8000")))
+HEALTH_LOOP_TIMEOUT   = 2
+HEALTH_MONGO_TIMEOUT  = 2
+HEALTH_MAX_CYCLE_SECONDS = int(os.getenv("HEALTH_MAX_CYCLE_SECONDS", "7200"))
+# Modo webhook: si hay WEBHOOK_URL (URL pública con https), Telegram envía los
+# updates a WEBHOOK_URL + WEBHOOK_PATH en el mismo puerto que el health check.
+WEBHOOK_URL           = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH          = "/telegram"
+WEBHOOK_SECRET        = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TELEGRAM_TOKEN.encode()).hexdigest()[:32]
+WEBHOOK_CONCURRENCY   = int(os.getenv("WEBHOOK_CONCURRENCY", "16"))   # updates atendidos a la vez
+WEBHOOK_MAX_BODY      = 1024 * 1024
+WEBHOOK_IDLE_TIMEOUT  = 75
 
 CATEGORIES = {
     "gays":                  {"name": "🏳️‍🌈 Gays",                "url": "https://sexosintabues30.com/category/relatos-eroticos/gays/"},
@@ -50,6 +118,7 @@ SKIP_TITLES = {
 
 logging.basicConfig(format="%(asctime)s | %(levelname)s | %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 HEADERS = {
     "User-Agent": (
@@ -60,22 +129,646 @@ HEADERS = {
 }
 
 
+# ══════════════════════════════════════════════
+# MÉTRICAS
+# ══════════════════════════════════════════════
+
+class Metrics:
+    """
+    Contadores e histogramas de latencia en memoria. Se exportan en formato
+    Prometheus en /metrics y se resumen con /stats. Es seguro usarlo desde
+    el hilo del servidor de salud.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    hist["buckets"][i] += 1
+                    break
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def quantile(self, hist: dict, q: float) -> float:
+        """Cuantil aproximado (límite superior del bucket que lo contiene)."""
+        target = q * hist["count"]
+        seen = 0
+        for bound, count in zip(self.BUCKETS, hist["buckets"]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: {**h, "buckets": list(h["buckets"])} for key, h in self.histograms.items()}
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_prom_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS, hist["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_prom_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_prom_labels(labels + (('le', '+Inf'),))} {hist['count']}")
+                lines.append(f"{name}_sum{_prom_labels(labels)} {hist['sum']:.6f}")
+                lines.append(f"{name}_count{_prom_labels(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _prom_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+metrics = Metrics()
+
+
+def timed(stage: str):
+    """Decorador: registra la duración de la función en relatos_stage_seconds{stage, op}."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with metrics.timer("relatos_stage_seconds", stage=stage, op=func.__name__):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.timer("relatos_stage_seconds", stage=stage, op=func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def build_stats_report() -> str:
+    """Resumen de latencias por etapa y contadores (para /stats)."""
+    lines = ["⏱ <b>Latencias por etapa</b>\n"]
+    with metrics.lock:
+        histograms = {key: {**h, "buckets": list(h["buckets"])} for key, h in metrics.histograms.items()}
+        counters = dict(metrics.counters)
+    if not histograms:
+        lines.append("<i>Sin datos todavía.</i>")
+    for (name, labels), hist in sorted(histograms.items(), key=lambda item: (item[0][0], dict(item[0][1]).get("stage", ""))):
+        tags = dict(labels)
+        label = " ".join(filter(None, (tags.get("stage") or name.removeprefix("relatos_"), tags.get("op"))))
+        avg_ms = hist["sum"] / hist["count"] * 1000
+        p95 = metrics.quantile(hist, 0.95)
+        lines.append(f"<code>{label}</code>: {hist['count']}× · media {avg_ms:.0f} ms · p95 ≤ {p95:g} s")
+    if counters:
+        lines.append("\n🔢 <b>Contadores</b>")
+        for (name, labels), value in sorted(counters.items()):
+            label = " ".join(str(v) for _, v in labels)
+            lines.append(f"<code>{name.removeprefix('relatos_')} {label}</code>: {value:g}")
+    return "\n".join(lines)
+
+
 # ══════════════════════════════════════════════
 # HEALTH CHECK
 # ══════════════════════════════════════════════
 
+# Estado que consultan /healthz y /readyz. Lo actualizan el ciclo de
+# publicación, el arranque/parada de la aplicación y el bucle de polling;
+# el servidor de salud lo lee desde su propio hilo.
+_health = {
+    "started_at": time.time(),
+    "loop": None,
+    "polling": "starting",
+    "cycle_started_at": None,
+    "last_success_at": None,
+    "last_error_at": None,
+    "last_error": None,
+}
+
+
+def _iso(ts) -> str | None:
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+
+
+def _probe_loop() -> float | None:
+    """Latencia (s) del bucle asyncio en atender una corrutina, o None si no responde."""
+    loop = _health["loop"]
+    if loop is None or loop.is_closed():
+        return None
+    start = time.perf_counter()
+    try:
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result(timeout=HEALTH_LOOP_TIMEOUT)
+    except Exception:
+        return None
+    return time.perf_counter() - start
+
+
+def _probe_mongo() -> tuple[float | None, int | None, str | None]:
+    """(latencia del ping en s, trabajos pendientes, error)."""
+    try:
+        with pymongo.timeout(HEALTH_MONGO_TIMEOUT):
+            db = get_db()
+            start = time.perf_counter()
+            db.command("ping")
+            latency = time.perf_counter() - start
+            backlog = db.jobs.count_documents({"state": {"$in": list(JOB_STATES[:-1])}})
+        return latency, backlog, None
+    except Exception as e:
+        return None, None, str(e)
+
+
+def health_report(path: str) -> tuple[int, dict]:
+    """
+    /healthz (vivacidad): el bucle asyncio responde, el polling no se ha
+    detenido y ningún ciclo lleva más de HEALTH_MAX_CYCLE_SECONDS en curso.
+    /readyz (disponibilidad): además MongoDB responde al ping y el último
+    ciclo correcto no es más antiguo que dos intervalos de revisión.
+    """
+    now = time.time()
+    loop_latency = _probe_loop()
+    cycle_started = _health["cycle_started_at"]
+    last_success = _health["last_success_at"]
+    report = {
+        "polling": _health["polling"],
+        "loop_latency_ms": round(loop_latency * 1000, 1) if loop_latency is not None else None,
+        "cycle_running_for_s": round(now - cycle_started) if cycle_started else None,
+        "last_success_at": _iso(last_success),
+        "last_error_at": _iso(_health["last_error_at"]),
+        "last_error": _health["last_error"],
+        "uptime_s": round(now - _health["started_at"]),
+    }
+    problems = []
+    if _health["polling"] == "running" and loop_latency is None:
+        problems.append("el bucle asyncio no responde")
+    if _health["polling"] == "stopped":
+        problems.append("el polling está detenido")
+    if cycle_started and now - cycle_started > HEALTH_MAX_CYCLE_SECONDS:
+        problems.append("el ciclo de publicación está atascado")
+
+    if path == "/readyz":
+        ping, backlog, error = _probe_mongo()
+        report["mongo_ping_ms"] = round(ping * 1000, 1) if ping is not None else None
+        report["backlog"] = backlog
+        if error:
+            problems.append(f"MongoDB no responde: {error}")
+        if _health["polling"] != "running":
+            problems.append(f"polling en estado {_health['polling']}")
+        max_age = 2 * shortest_poll_interval() + HEALTH_MAX_CYCLE_SECONDS
+        if now - (last_success or _health["started_at"]) > max_age:
+            problems.append("sin ciclos correctos recientes")
+
+    report["status"] = "ok" if not problems else "fail"
+    report["problems"] = problems
+    return (200 if not problems else 503), report
+
+
+def health_response(path: str) -> tuple[int, str, str]:
+    """(estado, cuerpo, content-type) de /metrics, /healthz, /readyz o "OK" para lo demás."""
+    if path == "/metrics":
+        return 200, metrics.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+    if path in ("/healthz", "/readyz"):
+        status, report = health_report(path)
+        return status, json.dumps(report, ensure_ascii=False), "application/json; charset=utf-8"
+    return 200, "OK", "text/plain; charset=utf-8"
+
+
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        self.send_response(200)
+        self._reply(*health_response(self.path.split("?")[0]))
+
+    def _reply(self, status: int, body: str, content_type: str):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
         self.end_headers()
-        self.wfile.write(b"OK")
+        self.wfile.write(data)
+
     def log_message(self, format, *args):
         pass
 
 def start_health_server():
-    server = HTTPServer(("0.0.0.0", 8000), HealthHandler)
+    server = ThreadingHTTPServer(("0.0.0.0", HEALTH_PORT), HealthHandler)
+    server.daemon_threads = True
     threading.Thread(target=server.serve_forever, daemon=True).start()
-    logger.info("Health check en puerto 8000.")
+    logger.info(f"Health check en puerto {HEALTH_PORT} (/healthz, /readyz, /metrics).")
+
+
+# ══════════════════════════════════════════════
+# WEBHOOK
+# ══════════════════════════════════════════════
+#
+# Servidor HTTP mínimo sobre asyncio, en el bucle del bot: recibe los
+# updates de Telegram en WEBHOOK_PATH y sirve también /healthz, /readyz y
+# /metrics, sin hilo aparte ni conexión de long polling. Las sondas de salud
+# se calculan en un hilo (asyncio.to_thread) porque _probe_loop espera a que
+# este mismo bucle atienda una corrutina.
+
+class WebhookServer:
+    def __init__(self, app: Application):
+        self.app = app
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, "0.0.0.0", HEALTH_PORT)
+        logger.info(f"Webhook y health check en puerto {HEALTH_PORT} ({WEBHOOK_PATH}, /healthz, /readyz, /metrics).")
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Atiende peticiones HTTP/1.1 de una conexión (con keep-alive) hasta que se cierre."""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), WEBHOOK_IDLE_TIMEOUT)
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > WEBHOOK_MAX_BODY:
+                    await self._reply(writer, 413, "Too Large", "text/plain; charset=utf-8", keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload, content_type = await self._route(method, target.split("?")[0], headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._reply(writer, status, payload, content_type, keep_alive, head_only=method == "HEAD")
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, str, str]:
+        if path == WEBHOOK_PATH:
+            status = await self._receive_update(method, headers, body)
+            metrics.inc("relatos_webhook_requests_total", status=str(status))
+            return status, HTTPStatus(status).phrase, "text/plain; charset=utf-8"
+        if method not in ("GET", "HEAD"):
+            return 405, "Method Not Allowed", "text/plain; charset=utf-8"
+        return await asyncio.to_thread(health_response, path)
+
+    async def _receive_update(self, method: str, headers: dict, body: bytes) -> int:
+        """
+        Valida el secreto y encola el update; responde en cuanto está en cola
+        para que Telegram no reenvíe (los handlers corren aparte, en paralelo).
+        """
+        if method != "POST":
+            return 405
+        secret = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            logger.warning("Petición al webhook con secreto incorrecto.")
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except Exception as e:
+            logger.warning(f"Update no válido en el webhook: {e}")
+            return 400
+        await self.app.update_queue.put(update)
+        return 200
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, status: int, body: str, content_type: str, keep_alive: bool,
+                     head_only: bool = False):
+        """Respuesta HTTP/1.1; a un HEAD se le mandan solo las cabeceras (con el Content-Length del GET)."""
+        data = body.encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + (b"" if head_only else data))
+        await writer.drain()
+
+
+async def run_webhook(app: Application):
+    """
+    Arranque manual de la aplicación en modo webhook (equivale a
+    run_polling: initialize, post_init, start; y al parar, stop, shutdown,
+    post_shutdown). El webhook no se borra al parar: durante un despliegue
+    la instancia nueva ya lo habrá apuntado a sí misma.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(app)
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await server.start()
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            # Telegram guarda los updates mientras el bot reinicia: se atienden al volver
+            drop_pending_updates=False,
+        )
+        await app.start()
+        logger.info(f"Webhook registrado en {WEBHOOK_URL}{WEBHOOK_PATH}.")
+        await stop.wait()
+    finally:
+        await server.close()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+# ══════════════════════════════════════════════
+# HTTP
+# ══════════════════════════════════════════════
+
+_http = None
+_host_limiters = {}
+
+
+class HostLimiter:
+    """Limita la concurrencia y espacia las peticiones a un mismo host sin bloquear el loop."""
+    def __init__(self, concurrency: int, delay: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self.next_slot = 0.0
+
+    async def wait_turn(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.delay
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def get_http() -> httpx.AsyncClient:
+    """Cliente HTTP compartido (keep-alive) para todo el scraping."""
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _http
+
+async def close_http():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+def get_host_limiter(url: str) -> HostLimiter:
+    host = urlsplit(url).netloc
+    limiter = _host_limiters.get(host)
+    if limiter is None:
+        limiter = _host_limiters[host] = HostLimiter(HTTP_HOST_CONCURRENCY, HTTP_HOST_DELAY)
+    return limiter
+
+class Page(NamedTuple):
+    body: bytes
+    encoding: str
+    not_modified: bool = False  # True si el servidor respondió 304 y el cuerpo viene de la caché
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding, errors="replace")
+
+
+class PageCache:
+    """
+    Caché en disco de páginas HTTP: cuerpo comprimido con zlib más los
+    validadores (ETag / Last-Modified). Expulsa por tamaño total, empezando
+    por las entradas usadas hace más tiempo.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = None
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith(".tmp")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self.entries = OrderedDict((entry.name, entry.stat().st_size) for entry in files)
+        self.total = sum(self.entries.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def get(self, url: str) -> dict | None:
+        key = self._key(url)
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                meta, body = f.read().split(b"\n", 1)
+            os.utime(self._path(key))
+            entry = json.loads(meta)
+            entry["body"] = zlib.decompress(body)
+            return entry if entry.get("url") == url else None
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def put(self, url: str, body: bytes, encoding: str, etag: str | None, last_modified: str | None):
+        key = self._key(url)
+        meta = {"url": url, "encoding": encoding, "etag": etag, "last_modified": last_modified}
+        data = json.dumps(meta).encode("utf-8") + b"\n" + zlib.compress(body, 6)
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old_key, size = self.entries.popitem(last=False)
+                self.total -= size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+
+_page_cache = PageCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_MB * 1024 * 1024)
+
+
+async def fetch_page(url: str, encoding: str | None = None) -> Page:
+    """
+    GET asíncrono respetando los límites por host. Si hay copia en caché se
+    envía un GET condicional; ante un 304 se devuelve la copia con
+    `not_modified=True`. Lanza excepción si falla.
+    """
+    cached = await asyncio.to_thread(_page_cache.get, url)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    limiter = get_host_limiter(url)
+    async with limiter.semaphore:
+        await limiter.wait_turn()
+        resp = await get_http().get(url, headers=headers)
+
+    if resp.status_code == 304 and cached:
+        return Page(cached["body"], encoding or cached["encoding"], not_modified=True)
+    resp.raise_for_status()
+    encoding = encoding or resp.encoding or "utf-8"
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if etag or last_modified:
+        await asyncio.to_thread(_page_cache.put, url, resp.content, encoding, etag, last_modified)
+    return Page(resp.content, encoding)
+
+async def fetch_text(url: str, encoding: str | None = None) -> str:
+    return (await fetch_page(url, encoding)).text
+
+
+# ══════════════════════════════════════════════
+# LÍMITES DE API (Telegraph / Telegram)
+# ══════════════════════════════════════════════
+
+class TokenBucket:
+    """
+    Token bucket asíncrono compartido por todos los que llaman a una API.
+    Un flood-wait bloquea a todos hasta que expira y reduce la tasa a la
+    mitad; cada llamada correcta la recupera poco a poco.
+    """
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            while True:
+                now = loop.time()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                if self.updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def flood_wait(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, asyncio.get_running_loop().time() + seconds)
+        self.tokens = 0
+        # El relleno empieza cuando acaba el bloqueo: nada de ráfaga al expirar
+        self.updated = self.blocked_until
+        self.rate = max(self.base_rate / 8, self.rate / 2)
+
+    def success(self):
+        self.rate = min(self.base_rate, self.rate * 1.05)
+
+
+_telegraph_bucket = TokenBucket("telegraph", TELEGRAPH_RATE, 3)
+_telegram_bucket = TokenBucket("telegram", TELEGRAM_RATE, 3)
+
+
+def flood_wait_seconds(error: Exception) -> float | None:
+    """Segundos de espera pedidos por Telegram (RetryAfter) o Telegraph (FLOOD_WAIT_X)."""
+    if isinstance(error, RetryAfter):
+        return float(error.retry_after)
+    if isinstance(error, TelegraphException) and "FLOOD_WAIT" in str(error):
+        try:
+            return float(str(error).split("FLOOD_WAIT_")[1].split()[0])
+        except Exception:
+            return 60.0
+    return None
+
+
+async def api_call(bucket: TokenBucket, func, *args, **kwargs):
+    """
+    Llama a `func` respetando el limitador. Las funciones síncronas (Telegraph)
+    se ejecutan en un hilo. Ante un flood-wait se espera y se reintenta.
+    """
+    for attempt in range(1, API_MAX_RETRIES + 1):
+        await bucket.acquire()
+        op = getattr(func, "__name__", "call")
+        try:
+            with metrics.timer("relatos_stage_seconds", stage=bucket.name, op=op):
+                if asyncio.iscoroutinefunction(func):
+                    result = await func(*args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as e:
+            wait = flood_wait_seconds(e)
+            if wait is not None:
+                metrics.inc("relatos_flood_waits_total", api=bucket.name)
+            if wait is None or attempt == API_MAX_RETRIES:
+                raise
+            wait = min(wait, 3600)
+            logger.warning(f"Flood wait de {wait:.0f}s en {getattr(func, '__name__', func)}. Esperando...")
+            bucket.flood_wait(wait)
+            continue
+        bucket.success()
+        return result
 
 
 # ══════════════════════════════════════════════
@@ -91,44 +784,450 @@ def get_db():
         _db = client["relatos_bot"]
     return _db
 
-def is_published(url: str) -> bool:
-    return get_db().published.find_one({"url": url}) is not None
+def ensure_indexes():
+    """
+    Crea los índices que usan las consultas del bot. Es idempotente y se
+    ejecuta en cada arranque; si hay duplicados que impiden un índice único,
+    los elimina (migración) y reintenta.
+    """
+    db = get_db()
+    _ensure_unique_index(db.published, "url")
+    # (category, date, _id): cada página del índice por categoría es un rango de este índice
+    db.published.create_index([("category", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)])
+    if "category_1_date_-1" in db.published.index_information():
+        db.published.drop_index("category_1_date_-1")
+    try:
+        # Índice de /buscar: título + palabras clave del texto (sin tildes, con raíces en español)
+        db.published.create_index(
+            [("title", TEXT), ("search_text", TEXT)],
+            weights={"title": 10, "search_text": 1}, default_language="spanish", name="busqueda",
+        )
+    except OperationFailure as e:
+        logger.error(f"No se pudo crear el índice de búsqueda: {e}")
+    _ensure_unique_index(db.config, "key")
+    _ensure_unique_index(db.jobs, "url")
+    db.jobs.create_index("state")
+    db.jobs.create_index("done_at", expireAfterSeconds=JOB_RETENTION_DAYS * 86400)
+    _ensure_unique_index(db.fingerprints, "url")
+    db.fingerprints.create_index("exact")
+    db.fingerprints.create_index("bands")
+    logger.info("Índices de MongoDB verificados.")
+
+def _ensure_unique_index(collection, field: str):
+    try:
+        collection.create_index(field, unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            logger.error(f"No se pudo crear índice único {collection.name}.{field}: {e}")
+            return
+        removed = _remove_duplicates(collection, field)
+        logger.warning(f"{removed} duplicados eliminados de {collection.name} por '{field}'.")
+        try:
+            collection.create_index(field, unique=True)
+        except OperationFailure as e:
+            # Quedan documentos sin `field` (null repetido): no se borran, se avisa
+            logger.error(f"No se pudo crear índice único {collection.name}.{field}: {e}")
+
+def _remove_duplicates(collection, field: str) -> int:
+    """
+    Deja solo el documento más reciente por cada valor repetido de `field`.
+    Los documentos sin `field` no se tocan, y cada _id eliminado queda en el log.
+    """
+    pipeline = [
+        {"$match": {field: {"$ne": None}}},
+        {"$sort": {"_id": -1}},
+        {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    removed = 0
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        kept, duplicates = group["ids"][0], group["ids"][1:]
+        logger.warning(
+            f"{collection.name}: {field}={group['_id']!r} repetido; se conserva {kept} "
+            f"y se eliminan {', '.join(map(str, duplicates))}"
+        )
+        removed += collection.delete_many({"_id": {"$in": duplicates}}).deleted_count
+    return removed
+
+def _plan_summary(explain: dict) -> str:
+    """Resume el plan ganador de un explain(), p. ej. 'LIMIT > FETCH > IXSCAN(url_1)'."""
+    plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage")
+    return " > ".join(stages)
+
+def build_db_report() -> str:
+    """Estado de índices y planes de las consultas principales (para /db_status)."""
+    db = get_db()
+    lines = ["🗄 <b>MongoDB</b>\n"]
+    for collection in (db.published, db.config):
+        lines.append(f"<b>{collection.name}</b>")
+        building = set()
+        try:
+            for stat in collection.aggregate([{"$indexStats": {}}]):
+                if stat.get("building"):
+                    building.add(stat["name"])
+        except OperationFailure:
+            pass
+        for name, info in collection.index_information().items():
+            keys = ", ".join(f"{k} {v}" for k, v in info["key"])
+            flags = " único" if info.get("unique") else ""
+            state = " ⏳ construyendo" if name in building else ""
+            lines.append(f"  • <code>{name}</code> ({keys}){flags}{state}")
+
+    first_cat = next(iter(CATEGORIES))
+    queries = {
+        "published por url": db.published.find({"url": ""}),
+        "published por categoría": db.published.find({"category": first_cat}).sort([("date", -1), ("_id", -1)]).limit(CATEGORY_PAGE_SIZE),
+        "config por key": db.config.find({"key": "index_message_id"}),
+    }
+    lines.append("\n<b>Planes</b>")
+    for label, cursor in queries.items():
+        lines.append(f"  • {label}: <code>{_plan_summary(cursor.explain())}</code>")
+    return "\n".join(lines)
+
+_published_urls = None
+
+def get_published_urls() -> set:
+    """Conjunto en memoria de URLs ya publicadas; se carga una vez desde MongoDB."""
+    global _published_urls
+    if _published_urls is None:
+        with metrics.timer("relatos_stage_seconds", stage="mongo", op="load_published_urls"):
+            cursor = get_db().published.find({}, {"_id": 0, "url": 1})
+            _published_urls = {doc["url"] for doc in cursor if doc.get("url")}
+        logger.info(f"{len(_published_urls)} URLs publicadas cargadas en memoria.")
+    return _published_urls
+
+def filter_unpublished(urls: list) -> list:
+    """
+    Devuelve, en el mismo orden, las URLs que aún no están publicadas.
+    Las ya conocidas se descartan sin consultar la base; el resto se
+    comprueba en una sola consulta `$in`.
+    """
+    known = get_published_urls()
+    pending = [url for url in urls if url not in known]
+    if pending:
+        with metrics.timer("relatos_stage_seconds", stage="mongo", op="filter_unpublished"):
+            cursor = get_db().published.find({"url": {"$in": pending}}, {"_id": 0, "url": 1})
+            found = {doc["url"] for doc in cursor}
+        if found:
+            known.update(found)
+            pending = [url for url in pending if url not in found]
+    return pending
+
+@timed("mongo")
+def mark_published(url: str, title: str, telegraph_urls: list, pub_date: str, category: str,
+                   duplicate_of: str | None = None, keywords: str = ""):
+    """
+    Registra el relato con la URL de todas sus partes en Telegraph.
+    `duplicate_of` es la URL del original cuando el relato es una reedición
+    enlazada a sus páginas de Telegraph. `keywords` (extraction.search_keywords)
+    entra en el índice de búsqueda junto con el título.
+    """
+    get_published_urls().add(url)
+    selector, update = _published_update(url, title, telegraph_urls, pub_date, category, duplicate_of, keywords)
+    result = get_db().published.update_one(selector, update, upsert=True)
+    _after_published(result.upserted_id is not None, update)
+
+def _published_update(url: str, title: str, telegraph_urls: list, pub_date: str, category: str,
+                      duplicate_of: str | None = None, keywords: str = "") -> tuple:
+    fields = {
+        "url": url, "title": title, "telegraph_url": telegraph_urls[0], "telegraph_urls": telegraph_urls,
+        "pub_date": pub_date, "category": category, "date": datetime.now()
+    }
+    if duplicate_of:
+        fields["duplicate_of"] = duplicate_of
+    if keywords:
+        fields["search_text"] = keywords
+    # _id generado aquí para conocerlo también en los bulk_write (cursor de paginación)
+    return {"url": url}, {"$set": fields, "$setOnInsert": {"_id": ObjectId()}}
+
+# Las etapas registran desde hilos (asyncio.to_thread): las cachés se tocan con este lock
+_cache_lock = threading.Lock()
+
+def _after_published(inserted: bool, update: dict):
+    """Mantiene al día las cachés de conteos y de últimos relatos."""
+    with _cache_lock:
+        if inserted:
+            story = {**update["$set"], **update["$setOnInsert"]}
+            category = story["category"]
+            if _category_counts is not None:
+                _category_counts[category] = _category_counts.get(category, 0) + 1
+            add_to_latest(category, {key: story[key] for key in CATEGORY_FIELDS})
+        else:
+            # Reescritura de un documento existente: puede haber cambiado de categoría
+            invalidate_category_counts()
+            invalidate_latest()
+
+CATEGORY_FIELDS = ("_id", "date", "title", "telegraph_url", "pub_date")
+
+@timed("mongo")
+def get_published_by_category(category: str, limit: int = CATEGORY_PAGE_SIZE,
+                              before: tuple | None = None, after: tuple | None = None) -> list:
+    """
+    Hasta `limit` relatos de la categoría (más antiguo primero) en orden
+    (date, _id): los más recientes, o los inmediatamente anteriores/posteriores
+    a la posición `before`/`after` = (date, _id). Paginación por rango de
+    índice: cada página cuesta lo mismo por lejos que esté.
+    """
+    query = {"category": category}
+    order = DESCENDING
+    if before or after:
+        date, oid = before or after
+        op = "$lt" if before else "$gt"
+        query["$or"] = [{"date": {op: date}}, {"date": date, "_id": {op: oid}}]
+        if after:
+            order = ASCENDING
+    cursor = get_db().published.find(
+        query, {key: 1 for key in CATEGORY_FIELDS}
+    ).sort([("date", order), ("_id", order)]).limit(limit)
+    stories = list(cursor)
+    if order == DESCENDING:
+        stories.reverse()
+    return stories
+
+_category_counts = None
 
-def mark_published(url: str, title: str, telegraph_url: str, pub_date: str, category: str):
-    get_db().published.update_one(
-        {"url": url},
-        {"$set": {
-            "url": url, "title": title, "telegraph_url": telegraph_url,
-            "pub_date": pub_date, "category": category, "date": datetime.now()
-        }},
-        upsert=True,
-    )
+def get_category_counts() -> dict:
+    """
+    Relatos por categoría (None = sin categoría) calculados con una sola
+    agregación y mantenidos en memoria por mark_published.
+    """
+    global _category_counts
+    if _category_counts is None:
+        pipeline = [{"$group": {"_id": "$category", "count": {"$sum": 1}}}]
+        with metrics.timer("relatos_stage_seconds", stage="mongo", op="category_counts"):
+            _category_counts = {doc["_id"]: doc["count"] for doc in get_db().published.aggregate(pipeline)}
+    return _category_counts
 
-def get_published_by_category(category: str, limit: int = 0) -> list:
-    cursor = get_db().published.find(
-        {"category": category},
-        {"_id": 0, "title": 1, "telegraph_url": 1, "pub_date": 1}
-    ).sort("date", -1)
-    if limit:
-        cursor = cursor.limit(limit)
-    return list(reversed(list(cursor)))
+def invalidate_category_counts():
+    global _category_counts
+    _category_counts = None
 
 def count_published() -> int:
-    return get_db().published.count_documents({})
+    return sum(get_category_counts().values())
 
 def count_by_category(category: str) -> int:
-    return get_db().published.count_documents({"category": category})
+    return get_category_counts().get(category, 0)
+
+@timed("mongo")
+def get_config(key: str, default=None):
+    doc = get_db().config.find_one({"key": key})
+    return doc["value"] if doc else default
+
+@timed("mongo")
+def set_config(key: str, value):
+    get_db().config.update_one(
+        {"key": key},
+        {"$set": {"key": key, "value": value}},
+        upsert=True,
+    )
 
 def get_index_message_id() -> int | None:
-    doc = get_db().config.find_one({"key": "index_message_id"})
-    return doc["value"] if doc else None
+    return get_config("index_message_id")
 
 def set_index_message_id(message_id: int):
-    get_db().config.update_one(
-        {"key": "index_message_id"},
-        {"$set": {"key": "index_message_id", "value": message_id}},
+    set_config("index_message_id", message_id)
+
+def get_high_water(category: str) -> str | None:
+    """URL del relato más reciente visto en la última revisión de la categoría."""
+    return get_config(f"high_water_{category}")
+
+def set_high_water(category: str, url: str):
+    set_config(f"high_water_{category}", url)
+
+
+# Huellas de contenido (las calcula extraction.analyze_story): una por relato
+# original en `fingerprints`, con índices por hash exacto y por banda de SimHash.
+
+@timed("mongo")
+def save_fingerprint(url: str, fingerprint):
+    get_db().fingerprints.update_one({"url": url}, {"$set": _fingerprint_doc(url, fingerprint)}, upsert=True)
+
+def _fingerprint_doc(url: str, fingerprint) -> dict:
+    return {
+        "url": url, "exact": fingerprint.exact, "simhash": f"{fingerprint.simhash:016x}",
+        "bands": simhash_bands(fingerprint.simhash), "date": datetime.now(),
+    }
+
+@timed("mongo")
+def find_duplicate(url: str, fingerprint) -> dict | None:
+    """
+    Relato ya publicado con el mismo texto o a menos de SIMHASH_MAX_DISTANCE
+    bits de SimHash. Devuelve su documento de `published`, o None.
+    """
+    db = get_db()
+    docs = db.fingerprints.find(
+        {"$or": [{"exact": fingerprint.exact}, {"bands": {"$in": simhash_bands(fingerprint.simhash)}}],
+         "url": {"$ne": url}},
+        {"_id": 0, "url": 1, "exact": 1, "simhash": 1},
+    )
+    # Primero las coincidencias exactas, después las más cercanas
+    candidates = sorted(
+        (doc["exact"] != fingerprint.exact, hamming_distance(int(doc["simhash"], 16), fingerprint.simhash), doc["url"])
+        for doc in docs
+    )
+    candidates = [other for inexact, distance, other in candidates if not inexact or distance <= SIMHASH_MAX_DISTANCE]
+    if not candidates:
+        return None
+    # Solo cuenta si el original llegó a publicarse; de los publicados, el mejor candidato
+    published = {
+        doc["url"]: doc for doc in db.published.find(
+            {"url": {"$in": candidates}},
+            {"_id": 0, "url": 1, "title": 1, "telegraph_urls": 1, "telegraph_url": 1},
+        )
+    }
+    return next((published[other] for other in candidates if other in published), None)
+
+
+# ══════════════════════════════════════════════
+# COLA DE TRABAJOS (MongoDB)
+# ══════════════════════════════════════════════
+#
+# Cada relato descubierto es un documento en `jobs` (clave: URL de origen)
+# que avanza por los estados discovered → fetched → published → notified.
+# Cada etapa toma el trabajo con un lease temporal; si el proceso muere, el
+# lease caduca y el siguiente ciclo lo retoma en el estado en que quedó.
+# Tras JOB_MAX_ATTEMPTS fallos (los errores de red no cuentan) queda como
+# failed y vuelve a su estado JOB_RETRY_HOURS después, o en el próximo /backfill.
+# Son funciones síncronas: las etapas las llaman con asyncio.to_thread para
+# que los viajes a MongoDB no detengan el bucle.
+
+JOB_STATES = ("discovered", "fetched", "published", "notified")
+
+@timed("mongo")
+def enqueue_job(url: str, title: str, category: str) -> bool:
+    """Crea el trabajo si no existe. Devuelve True si es nuevo."""
+    now = datetime.now()
+    result = get_db().jobs.update_one(
+        {"url": url},
+        {"$setOnInsert": {
+            "url": url, "title": title, "cat_id": category, "state": "discovered",
+            "attempts": 0, "lease_until": None, "created": now, "updated": now,
+        }},
         upsert=True,
     )
+    return result.upserted_id is not None
+
+@timed("mongo")
+def lease_job(url: str, state: str) -> dict | None:
+    """Reserva el trabajo si está en `state` y nadie más lo tiene."""
+    now = datetime.now()
+    return get_db().jobs.find_one_and_update(
+        {"url": url, "state": state, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+        {"$set": {"lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS), "lease_owner": WORKER_ID}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+@timed("mongo")
+def advance_job(url: str, state: str, unset: tuple = (), **fields):
+    """Pasa el trabajo al siguiente estado y libera el lease."""
+    get_db().jobs.update_one({"url": url, "lease_owner": WORKER_ID}, _advance_update(state, unset, fields))
+
+@timed("mongo")
+def advance_jobs(urls: list, state: str):
+    """Como advance_job, para varios trabajos con una sola escritura."""
+    get_db().jobs.update_many({"url": {"$in": urls}, "lease_owner": WORKER_ID}, _advance_update(state, (), {}))
+
+def _advance_update(state: str, unset: tuple, fields: dict) -> dict:
+    now = datetime.now()
+    update = {"$set": {"state": state, "lease_until": None, "updated": now, **fields}}
+    if state == "notified":
+        update["$set"]["done_at"] = now
+    if unset:
+        update["$unset"] = {field: "" for field in unset}
+    return update
+
+@timed("mongo")
+def mark_published_batch(records: list):
+    """
+    mark_published + advance_job(..., "published") para un lote de relatos,
+    con un bulk_write por colección. Primero `published` y después `jobs`:
+    si el proceso muere entre ambos, el trabajo se retoma y la reescritura
+    es idempotente.
+    """
+    published_urls = get_published_urls()
+    inserted = [record["url"] not in published_urls for record in records]
+    updates = [
+        _published_update(r["url"], r["title"], r["urls"], r["pub_date"], r["cat_id"], keywords=r.get("keywords", ""))
+        for r in records
+    ]
+    get_db().published.bulk_write([UpdateOne(*update, upsert=True) for update in updates], ordered=False)
+    for record, (_, update), new in zip(records, updates, inserted):
+        published_urls.add(record["url"])
+        _after_published(new, update)
+    get_db().jobs.bulk_write([
+        UpdateOne({"url": r["url"], "lease_owner": WORKER_ID},
+                  _advance_update("published", ("content", "keywords"), {"urls": r["urls"]}))
+        for r in records
+    ], ordered=False)
+
+@timed("mongo")
+def add_job_page(url: str, page: dict):
+    """Guarda cada página de Telegraph en cuanto se crea, para no duplicarla al reanudar."""
+    get_db().jobs.update_one({"url": url}, {"$push": {"pages": page}})
+
+@timed("mongo")
+def release_job(url: str, attempt: bool = True):
+    """
+    Libera el lease tras un fallo. Con `attempt` (fallo del propio relato, no
+    de la red) cuenta un intento; tras JOB_MAX_ATTEMPTS el trabajo queda como
+    failed hasta JOB_RETRY_HOURS después.
+    """
+    now = datetime.now()
+    update = {"$set": {"lease_until": None, "updated": now}}
+    if attempt:
+        update["$inc"] = {"attempts": 1}
+    job = get_db().jobs.find_one_and_update(
+        {"url": url, "lease_owner": WORKER_ID}, update, return_document=ReturnDocument.AFTER,
+    )
+    if job and job.get("attempts", 0) >= JOB_MAX_ATTEMPTS:
+        get_db().jobs.update_one({"_id": job["_id"]}, {"$set": {
+            "state": "failed", "failed_state": job["state"], "retry_at": now + timedelta(hours=JOB_RETRY_HOURS),
+        }})
+        logger.warning(f"  Trabajo abandonado tras {JOB_MAX_ATTEMPTS} intentos: {url}")
+
+@timed("mongo")
+def retry_failed_jobs(force: bool = False) -> int:
+    """
+    Devuelve los trabajos failed cuyo retry_at ya pasó (todos con `force`)
+    al estado en que fallaron, con los intentos a cero. Los que no guardaron
+    ese estado vuelven a discovered: rehacer la descarga es inocuo, y las
+    páginas de Telegraph ya creadas se reutilizan.
+    """
+    query = {"state": "failed"}
+    if not force:
+        query["$or"] = [{"retry_at": None}, {"retry_at": {"$lte": datetime.now()}}]
+    retried = 0
+    for state in JOB_STATES[:-1]:
+        failed_state = {"$in": [state, None]} if state == "discovered" else state
+        retried += get_db().jobs.update_many(
+            {**query, "failed_state": failed_state},
+            {"$set": {"state": state, "attempts": 0, "lease_until": None, "updated": datetime.now()},
+             "$unset": {"failed_state": "", "retry_at": ""}},
+        ).modified_count
+    return retried
+
+def is_transient(error: Exception) -> bool:
+    """Errores de red o de un servicio caído: no cuentan como intento del trabajo."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, NetworkError, OSError, asyncio.TimeoutError))
+
+@timed("mongo")
+def pending_jobs() -> list:
+    """Trabajos sin terminar y sin lease vigente (p. ej. de un proceso que se reinició)."""
+    now = datetime.now()
+    return list(get_db().jobs.find(
+        {"state": {"$in": list(JOB_STATES[:-1])},
+         "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+    ))
 
 
 # ══════════════════════════════════════════════
@@ -162,7 +1261,8 @@ async def update_index(bot):
 
         if message_id:
             try:
-                await bot.edit_message_text(
+                await api_call(
+                    _telegram_bucket, bot.edit_message_text,
                     chat_id=CHAT_ID,
                     message_id=message_id,
                     text=text,
@@ -174,7 +1274,8 @@ async def update_index(bot):
             except BadRequest as e:
                 logger.warning(f"No se pudo editar índice: {e}. Creando nuevo.")
 
-        msg = await bot.send_message(
+        msg = await api_call(
+            _telegram_bucket, bot.send_message,
             chat_id=CHAT_ID,
             text=text,
             parse_mode="HTML",
@@ -187,29 +1288,132 @@ async def update_index(bot):
         logger.error(f"Error actualizando índice: {e}")
 
 
-async def callback_category(update, context: ContextTypes.DEFAULT_TYPE):
-    """Muestra los últimos 25 relatos de la categoría."""
-    query = update.callback_query
-    await query.answer()
-
-    cat_id = query.data.replace("cat_", "")
-    cat = CATEGORIES.get(cat_id)
-    if not cat:
-        return
-
-    total = count_by_category(cat_id)
-    stories = get_published_by_category(cat_id, limit=25)
-
+_index_dirty = False
+_index_task = None
+_index_last_refresh = 0.0
+_index_lock = asyncio.Lock()
+
+def request_index_update(bot):
+    """Marca el índice como pendiente; una tarea en segundo plano lo refresca
+    como mucho una vez cada INDEX_REFRESH_SECONDS."""
+    global _index_dirty, _index_task
+    _index_dirty = True
+    if _index_task is None or _index_task.done():
+        _index_task = asyncio.create_task(_index_refresher(bot))
+
+async def _index_refresher(bot):
+    loop = asyncio.get_running_loop()
+    while True:
+        wait = _index_last_refresh + INDEX_REFRESH_SECONDS - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if not await _refresh_index_if_dirty(bot):
+            return
+
+async def flush_index(bot):
+    """Refresca el índice ahora mismo si hay cambios pendientes (fin de ciclo)."""
+    await _refresh_index_if_dirty(bot)
+
+async def _refresh_index_if_dirty(bot) -> bool:
+    global _index_dirty, _index_last_refresh
+    async with _index_lock:
+        if not _index_dirty:
+            return False
+        _index_dirty = False
+        _index_last_refresh = asyncio.get_running_loop().time()
+        await update_index(bot)
+        return True
+
+
+_latest = {}
+_latest_page = {}
+
+def get_latest_by_category(cat_id: str) -> deque:
+    """Últimos CATEGORY_PAGE_SIZE relatos de la categoría (más antiguo primero), en memoria."""
+    latest = _latest.get(cat_id)
+    if latest is None:
+        stories = get_published_by_category(cat_id)
+        latest = _latest[cat_id] = deque(stories, maxlen=CATEGORY_PAGE_SIZE)
+    return latest
+
+def add_to_latest(cat_id: str, story: dict):
+    """Añade un relato recién publicado a la caché sin volver a consultar la base."""
+    if cat_id in _latest:
+        _latest[cat_id].append(story)
+    _latest_page.pop(cat_id, None)
+
+def invalidate_latest():
+    _latest.clear()
+    _latest_page.clear()
+
+# Los botones ◀/▶ llevan la posición del primer/último relato de la página:
+# cat_<categoría>_<o|n>_<date en ms, base 36>_<_id en hex> (≤ 64 bytes).
+# "o" pide la página de relatos más antiguos y "n" la de más recientes.
+EPOCH = datetime(1970, 1, 1)
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def _base36(n: int) -> str:
+    digits = ""
+    while True:
+        n, r = divmod(n, 36)
+        digits = BASE36[r] + digits
+        if not n:
+            return digits
+
+def encode_category_cursor(cat_id: str, direction: str, story: dict) -> str:
+    # Milisegundos desde la época tomando la fecha sin zona como UTC, igual que pymongo
+    ms = (story["date"] - EPOCH) // timedelta(milliseconds=1)
+    return f"cat_{cat_id}_{direction}_{_base36(ms)}_{story['_id']}"
+
+def decode_category_cursor(data: str) -> tuple[str, str, tuple]:
+    """(categoría, dirección, (date, _id)); ValueError si el callback_data no es válido."""
+    cat_id, direction, ms, oid = data[len("cat_"):].rsplit("_", 3)
+    if direction not in ("o", "n"):
+        raise ValueError(direction)
+    return cat_id, direction, (EPOCH + timedelta(milliseconds=int(ms, 36)), ObjectId(oid))
+
+def get_category_page(cat_id: str, direction: str | None = None,
+                      position: tuple | None = None) -> tuple[str, InlineKeyboardMarkup | None]:
+    """
+    Texto HTML y botones de una página de la categoría. Sin cursor, los
+    últimos relatos (renderizados y cacheados en memoria); con cursor, una
+    consulta de CATEGORY_PAGE_SIZE + 1 documentos sobre el índice.
+    """
+    if direction is None:
+        page = _latest_page.get(cat_id)
+        if page is None:
+            # Instantánea, render y guardado bajo el lock: un relato publicado
+            # entre medias no puede dejar cacheada una página ya obsoleta
+            with _cache_lock:
+                stories = list(get_latest_by_category(cat_id))
+                has_older = count_by_category(cat_id) > len(stories)
+                page = _latest_page[cat_id] = render_category_page(cat_id, stories, has_older, False)
+        return page
+
+    if direction == "o":
+        stories = get_published_by_category(cat_id, CATEGORY_PAGE_SIZE + 1, before=position)
+        has_older, has_newer = len(stories) > CATEGORY_PAGE_SIZE, True
+        stories = stories[-CATEGORY_PAGE_SIZE:]
+    else:
+        stories = get_published_by_category(cat_id, CATEGORY_PAGE_SIZE + 1, after=position)
+        has_older, has_newer = True, len(stories) > CATEGORY_PAGE_SIZE
+        stories = stories[:CATEGORY_PAGE_SIZE]
+    return render_category_page(cat_id, stories, has_older, has_newer)
+
+def render_category_page(cat_id: str, stories: list, has_older: bool,
+                         has_newer: bool) -> tuple[str, InlineKeyboardMarkup | None]:
+    cat = CATEGORIES[cat_id]
     if not stories:
-        await query.message.reply_text(
-            f"{cat['name']}\n\n<i>No hay relatos publicados aún.</i>",
-            parse_mode="HTML",
-        )
-        return
+        if has_newer or has_older:
+            return f"{cat['name']}\n\n<i>No hay más relatos.</i>", None
+        return f"{cat['name']}\n\n<i>No hay relatos publicados aún.</i>", None
 
+    total = count_by_category(cat_id)
     lines = [f"<b>{cat['name']}</b>"]
-    if total > 25:
-        lines.append(f"<i>Últimos 25 de {total} relatos</i>\n")
+    if has_newer:
+        lines.append(f"<i>{len(stories)} relatos anteriores · {total} en total</i>\n")
+    elif has_older:
+        lines.append(f"<i>Últimos {len(stories)} de {total} relatos</i>\n")
     else:
         lines.append(f"<i>{total} relatos</i>\n")
 
@@ -227,26 +1431,153 @@ async def callback_category(update, context: ContextTypes.DEFAULT_TYPE):
     if len(text) > 4096:
         text = text[:4090] + "\n..."
 
-    await query.message.reply_text(
-        text,
-        parse_mode="HTML",
-        disable_web_page_preview=True,
-    )
+    buttons = []
+    if has_older:
+        buttons.append(InlineKeyboardButton(
+            "◀ Anteriores", callback_data=encode_category_cursor(cat_id, "o", stories[0])))
+    if has_newer:
+        buttons.append(InlineKeyboardButton(
+            "Recientes ▶", callback_data=encode_category_cursor(cat_id, "n", stories[-1])))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def callback_category(update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Botón del índice: envía los últimos relatos de la categoría (desde la
+    caché en memoria). Botones ◀/▶: cambia de página editando ese mensaje.
+    """
+    query = update.callback_query
+    await query.answer()
+
+    if query.data.count("_") == 1:
+        cat_id = query.data.replace("cat_", "")
+        if cat_id not in CATEGORIES:
+            return
+        text, keyboard = get_category_page(cat_id)
+        await query.message.reply_text(
+            text,
+            parse_mode="HTML",
+            reply_markup=keyboard,
+            disable_web_page_preview=True,
+        )
+        return
+
+    try:
+        cat_id, direction, position = decode_category_cursor(query.data)
+    except Exception:
+        return
+    if cat_id not in CATEGORIES:
+        return
+    text, keyboard = await asyncio.to_thread(get_category_page, cat_id, direction, position)
+    try:
+        await query.edit_message_text(
+            text, parse_mode="HTML", reply_markup=keyboard, disable_web_page_preview=True)
+    except BadRequest as e:
+        logger.warning(f"No se pudo cambiar de página en {cat_id}: {e}")
+
+
+# ══════════════════════════════════════════════
+# BÚSQUEDA
+# ══════════════════════════════════════════════
+#
+# /buscar usa el índice de texto "busqueda" de `published` (título +
+# palabras clave del relato), ordenado por relevancia. Los botones de
+# página llevan los términos en callback_data si caben en sus 64 bytes
+# ("bus_<página>_<términos>"); si no, una clave que apunta a los términos
+# guardados en memoria ("busk_<página>_<clave>").
+
+_searches = OrderedDict()
+SEARCH_MEMORY = 1000
+# build_search_page corre en hilos (asyncio.to_thread)
+_searches_lock = threading.Lock()
+
+@timed("mongo")
+def search_published(terms: str, page: int) -> list:
+    """Resultados de la página `page` (desde 0), más uno para saber si hay otra."""
+    cursor = get_db().published.find(
+        {"$text": {"$search": fold_text(terms)}, "duplicate_of": {"$exists": False}},
+        {"_id": 0, "title": 1, "telegraph_url": 1, "pub_date": 1, "category": 1,
+         "score": {"$meta": "textScore"}},
+    ).sort([("score", {"$meta": "textScore"}), ("date", DESCENDING)])
+    return list(cursor.skip(page * SEARCH_PAGE_SIZE).limit(SEARCH_PAGE_SIZE + 1))
+
+def search_callback_data(terms: str, page: int) -> str:
+    data = f"bus_{page}_{terms}"
+    if len(data.encode("utf-8")) <= 64:
+        return data
+    key = hashlib.sha1(terms.encode("utf-8")).hexdigest()[:12]
+    with _searches_lock:
+        _searches[key] = terms
+        _searches.move_to_end(key)
+        while len(_searches) > SEARCH_MEMORY:
+            _searches.popitem(last=False)
+    return f"busk_{page}_{key}"
+
+def build_search_page(terms: str, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    results = search_published(terms, page)
+    has_more = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+    if not results:
+        return f"🔎 Sin resultados para «{html.escape(terms)}».", None
+
+    lines = [f"🔎 <b>«{html.escape(terms)}»</b> · página {page + 1}\n"]
+    for i, story in enumerate(results, page * SEARCH_PAGE_SIZE + 1):
+        cat = CATEGORIES.get(story.get("category"), {}).get("name", "")
+        pub_date = story.get("pub_date", "")
+        date_str = f" <i>({pub_date})</i>" if pub_date else ""
+        cat_str = f" · {cat}" if cat else ""
+        lines.append(f'{i}. <a href="{story["telegraph_url"]}">{html.escape(story["title"])}</a>{cat_str}{date_str}')
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀ Anteriores", callback_data=search_callback_data(terms, page - 1)))
+    if has_more:
+        buttons.append(InlineKeyboardButton("Siguientes ▶", callback_data=search_callback_data(terms, page + 1)))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def callback_search(update, context: ContextTypes.DEFAULT_TYPE):
+    """Cambia de página una búsqueda editando el mismo mensaje."""
+    query = update.callback_query
+    await query.answer()
+
+    prefix, page, terms = query.data.split("_", 2)
+    if prefix == "busk":
+        with _searches_lock:
+            terms = _searches.get(terms)
+        if terms is None:
+            await query.edit_message_text("⌛ La búsqueda ha caducado; repítela con /buscar.")
+            return
+    text, keyboard = await asyncio.to_thread(build_search_page, terms, int(page))
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=keyboard, disable_web_page_preview=True)
 
 
 # ══════════════════════════════════════════════
 # SCRAPING
 # ══════════════════════════════════════════════
 
-def get_story_links_from_page(page_url: str, domain: str) -> list:
+_listing_memo = {}
+
+async def get_story_links_from_page(page_url: str, domain: str) -> list:
+    """
+    Relatos enlazados desde una página del listado. Un 404 (más allá de la
+    última página) es una página vacía; cualquier otro error se propaga
+    para no confundirlo con el final del listado.
+    """
     try:
-        resp = requests.get(page_url, headers=HEADERS, timeout=15)
-        resp.raise_for_status()
+        with metrics.timer("relatos_stage_seconds", stage="listing_fetch", op="get"):
+            page = await fetch_page(page_url)
     except Exception as e:
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404:
+            return []
         logger.error(f"Error accediendo {page_url}: {e}")
-        return []
+        metrics.inc("relatos_errors_total", stage="listing_fetch")
+        raise
+    # Listado sin cambios (304): reutilizar el resultado ya parseado
+    if page.not_modified and page_url in _listing_memo:
+        return _listing_memo[page_url]
 
-    soup = BeautifulSoup(resp.text, "html.parser")
+    soup = BeautifulSoup(page.text, "html.parser")
     stories = []
     seen_urls = set()
 
@@ -263,10 +1594,19 @@ def get_story_links_from_page(page_url: str, domain: str) -> list:
         seen_urls.add(href)
         stories.append({"title": title, "url": href})
 
+    _listing_memo[page_url] = stories
     return stories
 
 
-def get_all_story_links(base_url: str) -> list:
+async def get_all_story_links(base_url: str, high_water: str | None = None, deep: bool = False) -> tuple[list, bool]:
+    """
+    Recorre el listado paginado de una categoría.
+    En modo incremental se detiene en la página que contiene `high_water`
+    o en la primera página compuesta solo por relatos ya publicados.
+    Con `deep=True` recorre las MAX_PAGES páginas (backfill completo).
+    Devuelve (relatos, completo): `completo` es False si una página falló
+    y el recorrido se cortó antes de llegar a su final.
+    """
     domain = base_url.split("/")[2]
     all_stories = []
     seen_urls = set()
@@ -274,7 +1614,11 @@ def get_all_story_links(base_url: str) -> list:
     for page_num in range(1, MAX_PAGES + 1):
         page_url = base_url if page_num == 1 else f"{base_url}page/{page_num}/"
         logger.info(f"  Página {page_num}: {page_url}")
-        stories = get_story_links_from_page(page_url, domain)
+        try:
+            stories = await get_story_links_from_page(page_url, domain)
+        except Exception:
+            logger.warning(f"  Página {page_num} no disponible. Listado incompleto.")
+            return all_stories, False
         if not stories:
             logger.info(f"  Página {page_num} vacía. Deteniendo.")
             break
@@ -282,76 +1626,68 @@ def get_all_story_links(base_url: str) -> list:
             if s["url"] not in seen_urls:
                 seen_urls.add(s["url"])
                 all_stories.append(s)
-        import time; time.sleep(1)
-
-    return all_stories
-
+        if deep:
+            continue
+        page_urls = [s["url"] for s in stories]
+        if high_water and high_water in page_urls:
+            logger.info(f"  Página {page_num} alcanza la última revisión. Deteniendo.")
+            break
+        if not filter_unpublished(page_urls):
+            logger.info(f"  Página {page_num} ya publicada. Deteniendo.")
+            break
 
-def extract_pub_date(soup: BeautifulSoup) -> str:
-    time_tag = soup.find("time")
-    if time_tag:
-        dt = time_tag.get("datetime", "")
-        if dt:
-            try:
-                return datetime.fromisoformat(dt[:10]).strftime("%d/%m/%Y")
-            except Exception:
-                pass
-        text = time_tag.get_text(strip=True)
-        if text: return text
-    for selector in [".entry-date", ".post-date", ".published", ".date"]:
-        el = soup.select_one(selector)
-        if el: return el.get_text(strip=True)
-    return ""
-
-
-def clean_html_for_telegraph(html: str) -> str:
-    soup = BeautifulSoup(html, "html.parser")
-    for tag in soup.select("script, style, .sharedaddy, .jp-relatedposts, ins, iframe, form, nav"):
-        tag.decompose()
-    for div in soup.find_all("div"): div.name = "p"
-    for span in soup.find_all("span"): span.unwrap()
-    allowed = {"p", "br", "strong", "em", "b", "i", "a", "ul", "ol", "li", "h3", "h4", "blockquote", "figure", "figcaption", "img"}
-    for tag in soup.find_all(True):
-        if tag.name not in allowed:
-            tag.unwrap()
-        else:
-            attrs = {}
-            if tag.name == "a" and tag.get("href"): attrs["href"] = tag["href"]
-            if tag.name == "img" and tag.get("src"): attrs["src"] = tag["src"]
-            tag.attrs = attrs
-    return str(soup).encode("utf-8").decode("utf-8")
+    return all_stories, True
+
+
+# Parseo y limpieza en procesos aparte: son CPU puro y, en el hilo del bucle,
+# bloquean los comandos y no aprovechan más de un núcleo. Con "spawn" cada
+# proceso importa el script principal como __mp_main__ además de extraction.py:
+# arrancando con run.py ese script está vacío; con python bot.py cada proceso
+# carga el bot entero. Por defecto como mucho 2 procesos: en un dyno
+# os.cpu_count() suele dar los núcleos de la máquina, no los del contenedor.
+
+_parse_pool = None
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        if __name__ == "__main__":
+            logger.warning("Arrancado con bot.py: cada proceso de parseo cargará el bot entero; usa run.py.")
+        _parse_pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"Pool de parseo con {PARSE_WORKERS} procesos.")
+    return _parse_pool
+
+def close_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+async def run_parser(func, *args):
+    """Ejecuta `func` (de extraction) en el pool; sin pool, en el hilo del bucle."""
+    if PARSE_WORKERS <= 0:
+        return func(*args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_parse_pool(), func, *args)
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. por memoria): se recrea el pool y se reintenta una vez
+        logger.warning("Pool de parseo roto; recreándolo.")
+        close_parse_pool()
+        return await loop.run_in_executor(get_parse_pool(), func, *args)
 
 
-def get_story_content(story_url: str) -> tuple:
-    """Retorna (html_content, pub_date, real_title)"""
+async def get_story_content(story_url: str):
+    """Descarga y analiza el relato (extraction.StoryAnalysis). Lanza excepción si falla la descarga."""
     try:
-        resp = requests.get(story_url, headers=HEADERS, timeout=15)
-        resp.raise_for_status()
-        resp.encoding = "utf-8"
+        with metrics.timer("relatos_stage_seconds", stage="story_fetch", op="get"):
+            page = await fetch_page(story_url, encoding="utf-8")
     except Exception as e:
         logger.error(f"Error descargando {story_url}: {e}")
-        return "", "", ""
-    soup = BeautifulSoup(resp.text, "html.parser")
-    pub_date = extract_pub_date(soup)
-
-    # Obtener título real de la página
-    real_title = ""
-    for selector in [".entry-title", "h1.post-title", "h1", "title"]:
-        el = soup.select_one(selector)
-        if el:
-            real_title = el.get_text(strip=True)
-            # Limpiar sufijos típicos de WordPress como " – Nombre del Sitio"
-            for sep in [" – ", " | ", " - "]:
-                if sep in real_title:
-                    real_title = real_title.split(sep)[0].strip()
-            if real_title:
-                break
-
-    for selector in [".entry-content", ".post-content", "article .content", "article"]:
-        content = soup.select_one(selector)
-        if content:
-            return clean_html_for_telegraph(str(content)), pub_date, real_title
-    return "<p>No se pudo extraer el contenido.</p>", pub_date, real_title
+        metrics.inc("relatos_errors_total", stage="story_fetch")
+        raise
+    with metrics.timer("relatos_stage_seconds", stage="parse_clean", op="extract_story"):
+        return await run_parser(analyze_story, page.body, page.encoding)
 
 
 # ══════════════════════════════════════════════
@@ -359,121 +1695,849 @@ def get_story_content(story_url: str) -> tuple:
 # ══════════════════════════════════════════════
 
 _telegraph = None
+_telegraph_lock = threading.Lock()
 
 def get_telegraph() -> Telegraph:
+    """Cuenta de Telegraph persistente: el token se guarda en `config` y se reutiliza."""
     global _telegraph
-    if _telegraph is None:
-        _telegraph = Telegraph()
-        _telegraph.create_account(short_name=TELEGRAPH_AUTHOR)
-        logger.info("Cuenta Telegraph creada.")
+    # Se llama desde varios hilos de publicación a la vez
+    with _telegraph_lock:
+        if _telegraph is None:
+            token = get_config("telegraph_token")
+            if token:
+                _telegraph = Telegraph(access_token=token)
+            else:
+                _telegraph = Telegraph()
+                _telegraph.create_account(short_name=TELEGRAPH_AUTHOR)
+                set_config("telegraph_token", _telegraph.get_access_token())
+                logger.info("Cuenta Telegraph creada.")
     return _telegraph
 
 
-def publish_to_telegraph(title: str, html_content: str) -> list:
-    tph = get_telegraph()
+def node_size(node) -> int:
+    """Bytes que ocupa el nodo en el JSON que se envía a Telegraph."""
+    return len(json.dumps(node)) + 1
+
+
+def split_nodes(nodes: list, max_size: int) -> list:
+    """Reparte los nodos en tantas partes como haga falta para que ninguna supere `max_size`."""
+    parts, current, size = [], [], 0
+    for node in _fit_nodes(nodes, max_size):
+        n = node_size(node)
+        if current and size + n > max_size:
+            parts.append(current)
+            current, size = [], 0
+        current.append(node)
+        size += n
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _fit_nodes(nodes: list, max_size: int):
+    """Produce los nodos partiendo los que por sí solos superan `max_size`."""
+    for node in nodes:
+        if node_size(node) <= max_size:
+            yield node
+        elif isinstance(node, str):
+            yield from _split_text(node, max_size)
+        elif node.get("children"):
+            # Repartir los hijos en varias copias del mismo elemento
+            shell = {k: v for k, v in node.items() if k != "children"}
+            budget = max_size - node_size(shell) - len(',"children":[]')
+            for chunk in split_nodes(node["children"], budget):
+                yield {**shell, "children": chunk}
+        else:
+            yield node
+
+
+def _split_text(text: str, max_size: int):
+    words = text.split(" ")
+    chunk, size = [], 2
+    for word in words:
+        n = node_size(word) - 2
+        if 2 + n > max_size:
+            # Palabra que no cabe ni sola: se trocea y el último trozo sigue como palabra
+            if chunk:
+                yield " ".join(chunk) + " "
+                chunk, size = [], 2
+            *pieces, word = _split_word(word, max_size)
+            yield from pieces
+            n = node_size(word) - 2
+        if chunk and size + n > max_size:
+            yield " ".join(chunk) + " "
+            chunk, size = [], 2
+        chunk.append(word)
+        size += n
+    if chunk:
+        yield " ".join(chunk)
+
+
+def _split_word(word: str, max_size: int):
+    piece, size = [], 3
+    for char in word:
+        n = len(json.dumps(char)) - 2
+        if piece and size + n > max_size:
+            yield "".join(piece)
+            piece, size = [], 3
+        piece.append(char)
+        size += n
+    if piece:
+        yield "".join(piece)
+
+
+def _nav_node(url: str, label: str) -> dict:
+    return {"tag": "p", "children": [{"tag": "em", "children": [
+        {"tag": "a", "attrs": {"href": url}, "children": [label]},
+    ]}]}
+
+
+async def publish_to_telegraph(title: str, nodes: list, pages: list | None = None, on_page=None) -> list:
+    """
+    Publica el relato, dividido en tantas partes enlazadas como exija su tamaño.
+    `pages` son las partes ya creadas en un intento anterior (se reutilizan) y
+    `on_page` (asíncrona) se espera con cada parte nueva en cuanto existe.
+    """
+    tph = await asyncio.to_thread(get_telegraph)
+    parts = split_nodes(nodes, MAX_CONTENT_SIZE - NAV_RESERVE)
+    pages = list(pages or [])
+
+    async def create(index: int, page_title: str, content: list):
+        if index < len(pages):
+            return
+        r = await api_call(_telegraph_bucket, tph.create_page, title=page_title, content=content, author_name=TELEGRAPH_AUTHOR)
+        page = {"path": r["path"], "url": f"https://telegra.ph/{r['path']}"}
+        pages.append(page)
+        if on_page:
+            await on_page(page)
+
+    if len(parts) == 1:
+        await create(0, title, parts[0])
+        return [pages[0]["url"]]
+
+    contents = []
+    for i, part in enumerate(parts, 1):
+        content = list(part)
+        if i > 1:
+            content.insert(0, _nav_node(pages[i - 2]["url"], f"← Parte {i - 1}"))
+        if i < len(parts):
+            content.append({"tag": "p", "children": [{"tag": "em", "children": [f"Continúa en Parte {i + 1}..."]}]})
+        contents.append(content)
+        await create(i - 1, f"{title} – Parte {i}", content)
+
+    # Ahora que se conocen todas las URLs, enlazar cada parte con la siguiente
+    for i, page in enumerate(pages[:len(parts) - 1], 1):
+        content = contents[i - 1][:-1] + [_nav_node(pages[i]["url"], f"Parte {i + 1} →")]
+        await api_call(
+            _telegraph_bucket, tph.edit_page,
+            page["path"], title=f"{title} – Parte {i}", content=content, author_name=TELEGRAPH_AUTHOR,
+        )
 
-    if len(html_content) <= MAX_CONTENT_SIZE:
-        r = tph.create_page(title=title, html_content=html_content, author_name=TELEGRAPH_AUTHOR)
-        return [f"https://telegra.ph/{r['path']}"]
+    return [page["url"] for page in pages[:len(parts)]]
 
-    # Dividir por párrafos
-    soup = BeautifulSoup(html_content, "html.parser")
-    paragraphs = soup.find_all(["p", "h3", "h4", "blockquote"])
 
-    if len(paragraphs) < 2:
-        r = tph.create_page(title=title, html_content=html_content[:MAX_CONTENT_SIZE], author_name=TELEGRAPH_AUTHOR)
-        return [f"https://telegra.ph/{r['path']}"]
+# ══════════════════════════════════════════════
+# LÓGICA PRINCIPAL
+# ══════════════════════════════════════════════
 
-    mid = len(paragraphs) // 2
-    part1_html = "".join(str(p) for p in paragraphs[:mid])
-    part2_html = "".join(str(p) for p in paragraphs[mid:])
+async def discover_stage(cat_id: str, cat: dict, story_q: asyncio.Queue, queued: set, deep: bool = False):
+    """
+    Etapa 1: recorre el listado de la categoría y crea un trabajo por relato
+    nuevo. Devuelve cuántos trabajos nuevos creó.
+    """
+    logger.info(f"Revisando categoría: {cat['name']}" + (" (backfill)" if deep else ""))
+    high_water = await asyncio.to_thread(get_high_water, cat_id)
+    stories, complete = await get_all_story_links(cat["url"], high_water, deep)
+    logger.info(f"  Encontrados: {len(stories)} relatos en {cat['name']}")
+    # Con el listado incompleto la marca no avanza: el próximo ciclo vuelve a
+    # recorrer hasta la anterior y recupera las páginas que fallaron
+    if stories and complete:
+        await asyncio.to_thread(set_high_water, cat_id, stories[0]["url"])
+    elif not complete:
+        logger.warning(f"  Listado de {cat['name']} incompleto; se mantiene la última revisión.")
+    unpublished = set(await asyncio.to_thread(filter_unpublished, [s["url"] for s in stories]))
+    created = 0
+    for story in stories:
+        url = story["url"]
+        # Un mismo relato puede aparecer en varias categorías a la vez
+        if url not in unpublished or url in queued:
+            continue
+        queued.add(url)
+        # Si el trabajo ya existía, lo retoma resume_jobs en el estado en que quedó
+        if await asyncio.to_thread(enqueue_job, url, story["title"], cat_id):
+            created += 1
+            await story_q.put({"url": url, "title": story["title"]})
+    # Los que ya tenían trabajo (reintentos, otra categoría) no cuentan para la tasa
+    return created
+
+
+async def release_quietly(url: str, error: Exception | None = None):
+    """
+    release_job para los bloques except de las etapas: si MongoDB tampoco
+    responde, lo registra y sigue. Un worker nunca debe salir de su bucle,
+    o su cola no se vacía y el ciclo se queda esperando en join().
+    Si `error` es de red, el fallo no gasta un intento.
+    """
+    try:
+        await asyncio.to_thread(release_job, url, not (error and is_transient(error)))
+    except Exception as e:
+        logger.error(f"  No se pudo liberar el trabajo {url}: {e}")
+
+
+async def resume_jobs(queues: dict, queued: set, deep: bool = False):
+    """
+    Reencola los trabajos que quedaron a medias en ciclos o procesos
+    anteriores, incluidos los fallidos que ya toca reintentar (todos en un backfill).
+    """
+    retried = await asyncio.to_thread(retry_failed_jobs, deep)
+    if retried:
+        logger.info(f"Reintentando {retried} trabajos fallidos.")
+    jobs = await asyncio.to_thread(pending_jobs)
+    if jobs:
+        logger.info(f"Reanudando {len(jobs)} trabajos pendientes.")
+    for job in jobs:
+        queued.add(job["url"])
+        await queues[job["state"]].put({"url": job["url"], "title": job["title"]})
+
+
+async def fetch_stage(story_q: asyncio.Queue, publish_q: asyncio.Queue):
+    """Etapa 2: descarga, parsea y limpia cada relato."""
+    while True:
+        story = await story_q.get()
+        try:
+            job = await asyncio.to_thread(lease_job, story["url"], "discovered")
+            if not job:
+                continue
+            logger.info(f"  Nuevo: {job['title']}")
+            analysis = await get_story_content(job["url"])
+            if not analysis.story.content:
+                await asyncio.to_thread(release_job, job["url"])
+                continue
+            story_data, fingerprint = analysis.story, analysis.fingerprint
+            # Usar el título real de la página si está disponible
+            title = job["title"]
+            if story_data.title:
+                logger.info(f"  Título original: {story_data.title}")
+                title = story_data.title
+            if fingerprint:
+                original = await asyncio.to_thread(find_duplicate, job["url"], fingerprint)
+                if original:
+                    await asyncio.to_thread(link_duplicate, job, title, story_data.pub_date, original)
+                    continue
+                await asyncio.to_thread(save_fingerprint, job["url"], fingerprint)
+            await asyncio.to_thread(
+                advance_job, job["url"], "fetched", title=title, content=story_data.content,
+                pub_date=story_data.pub_date, keywords=analysis.keywords,
+            )
+            await publish_q.put({"url": job["url"], "title": title})
+        except Exception as e:
+            logger.error(f"  Error descargando '{story['title']}': {e}")
+            await release_quietly(story["url"], e)
+        finally:
+            story_q.task_done()
+
+
+def link_duplicate(job: dict, title: str, pub_date: str, original: dict):
+    """
+    Reedición de un relato ya publicado: se registra en su categoría con los
+    enlaces de Telegraph del original, sin crear páginas ni avisar en el canal.
+    """
+    urls = original.get("telegraph_urls") or [original["telegraph_url"]]
+    mark_published(job["url"], title, urls, pub_date, job["cat_id"], duplicate_of=original["url"])
+    advance_job(job["url"], "notified", unset=("content", "keywords"), urls=urls, duplicate_of=original["url"])
+    metrics.inc("relatos_duplicates_total", category=job["cat_id"])
+    logger.info(f"  Duplicado de '{original.get('title', original['url'])}': se enlaza sin publicar")
+
+
+async def publish_stage(publish_q: asyncio.Queue, notify_q: asyncio.Queue, new_counts: dict,
+                        batch: "PublishBatch | None" = None):
+    """Etapa 3: publica en Telegraph y registra en MongoDB (en lotes si hay `batch`)."""
+    while True:
+        story = await publish_q.get()
+        try:
+            job = await asyncio.to_thread(lease_job, story["url"], "fetched")
+            if not job:
+                continue
+            urls = await publish_to_telegraph(
+                job["title"], job["content"], pages=job.get("pages"),
+                on_page=lambda page: asyncio.to_thread(add_job_page, job["url"], page),
+            )
+            if batch:
+                record = {key: job.get(key, "") for key in ("url", "title", "pub_date", "cat_id", "keywords")}
+                await batch.add({**record, "urls": urls}, story)
+            else:
+                await asyncio.to_thread(
+                    mark_published, job["url"], job["title"], urls, job["pub_date"], job["cat_id"],
+                    keywords=job.get("keywords", ""),
+                )
+                await asyncio.to_thread(
+                    advance_job, job["url"], "published", unset=("content", "keywords"), urls=urls)
+                await notify_q.put(story)
+            new_counts[job["cat_id"]] = new_counts.get(job["cat_id"], 0) + 1
+            metrics.inc("relatos_published_total", category=job["cat_id"])
+        except Exception as e:
+            logger.error(f"  Error publicando '{story['title']}': {e}")
+            metrics.inc("relatos_errors_total", stage="telegraph")
+            await release_quietly(story["url"], e)
+        finally:
+            publish_q.task_done()
 
-    r1 = tph.create_page(
-        title=f"{title} – Parte 1",
-        html_content=part1_html + "<p><em>Continúa en Parte 2...</em></p>",
-        author_name=TELEGRAPH_AUTHOR,
-    )
-    url1 = f"https://telegra.ph/{r1['path']}"
 
-    r2 = tph.create_page(
-        title=f"{title} – Parte 2",
-        html_content=f'<p><em><a href="{url1}">← Parte 1</a></em></p>' + part2_html,
-        author_name=TELEGRAPH_AUTHOR,
-    )
-    url2 = f"https://telegra.ph/{r2['path']}"
+def format_links(urls: list) -> str:
+    if len(urls) == 1:
+        return f'🔗 <a href="{urls[0]}">Leer en Telegraph</a>'
+    return "🔗 " + " | ".join(f'<a href="{u}">Parte {i}</a>' for i, u in enumerate(urls, 1))
+
+
+async def notify_stage(bot, notify_q: asyncio.Queue, digest: "Digest | None" = None):
+    """Etapa 4: avisa en el canal y refresca el índice (o acumula en `digest`)."""
+    while True:
+        story = await notify_q.get()
+        try:
+            job = await asyncio.to_thread(lease_job, story["url"], "published")
+            if not job:
+                continue
+            if digest:
+                digest.add(job)
+                continue
+            urls = job["urls"]
+            cat = CATEGORIES.get(job["cat_id"], {"name": job["cat_id"]})
+            pub_date = job.get("pub_date", "")
+            date_line = f"📅 <i>{pub_date}</i>\n\n" if pub_date else ""
+            cat_line = f"📂 <i>{cat['name']}</i>\n\n"
+            links = format_links(urls)
+
+            message = f"📖 <b>{job['title']}</b>\n\n{cat_line}{date_line}{links}"
+            await api_call(_telegram_bucket, bot.send_message, chat_id=CHAT_ID, text=message, parse_mode="HTML")
+            await asyncio.to_thread(advance_job, job["url"], "notified")
+            logger.info(f"  Publicado: {urls[0]}")
+            request_index_update(bot)
+        except Exception as e:
+            logger.error(f"  Error notificando '{story['title']}': {e}")
+            metrics.inc("relatos_errors_total", stage="telegram")
+            await release_quietly(story["url"], e)
+        finally:
+            notify_q.task_done()
+
+
+class PublishBatch:
+    """
+    Modo resumen, etapa 3: acumula los relatos ya publicados en Telegraph y
+    los registra juntos (mark_published_batch) cada DB_BATCH_SIZE relatos o
+    al vaciarse periódicamente. Solo entonces pasan a la etapa de aviso.
+    """
+
+    def __init__(self, notify_q: asyncio.Queue):
+        self.notify_q = notify_q
+        self.items = []
+        self.lock = asyncio.Lock()
+
+    async def add(self, record: dict, story: dict):
+        self.items.append((record, story))
+        if len(self.items) >= DB_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            items, self.items = self.items, []
+            if not items:
+                return
+            try:
+                await asyncio.to_thread(mark_published_batch, [record for record, _ in items])
+            except Exception as e:
+                logger.error(f"  Error registrando {len(items)} relatos: {e}")
+                for record, _ in items:
+                    await release_quietly(record["url"], e)
+                return
+            for _, story in items:
+                await self.notify_q.put(story)
+
+
+class Digest:
+    """
+    Modo resumen, etapa 4: agrupa los avisos por categoría y los envía como
+    mensajes con varios relatos (sin superar los 4096 caracteres de Telegram).
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.jobs = {}
+        self.lock = asyncio.Lock()
+
+    def add(self, job: dict):
+        self.jobs.setdefault(job["cat_id"], []).append(job)
+
+    async def flush(self):
+        async with self.lock:
+            pending, self.jobs = self.jobs, {}
+            for cat_id, jobs in pending.items():
+                for message, batch in build_digest_messages(cat_id, jobs):
+                    urls = [job["url"] for job in batch]
+                    try:
+                        await api_call(
+                            _telegram_bucket, self.bot.send_message,
+                            chat_id=CHAT_ID, text=message, parse_mode="HTML", disable_web_page_preview=True,
+                        )
+                    except Exception as e:
+                        logger.error(f"  Error enviando resumen de {len(batch)} relatos: {e}")
+                        metrics.inc("relatos_errors_total", stage="telegram")
+                        for url in urls:
+                            await release_quietly(url, e)
+                        continue
+                    await asyncio.to_thread(advance_jobs, urls, "notified")
+                    logger.info(f"  Resumen enviado: {len(batch)} relatos en {cat_id}")
+            if pending:
+                request_index_update(self.bot)
+
+
+def build_digest_messages(cat_id: str, jobs: list) -> list:
+    """Reparte los relatos de una categoría en mensajes de hasta 4096 caracteres."""
+    cat = CATEGORIES.get(cat_id, {"name": cat_id})
+    entries = []
+    for job in jobs:
+        pub_date = job.get("pub_date", "")
+        date_str = f" <i>({pub_date})</i>" if pub_date else ""
+        entries.append((f"📖 <b>{html.escape(job['title'])}</b>{date_str}\n{format_links(job['urls'])}", job))
+
+    messages, lines, batch = [], [], []
+    def close():
+        header = f"📚 <b>{len(batch)} relatos nuevos</b> · 📂 <i>{cat['name']}</i>"
+        messages.append(("\n\n".join([header, *lines]), batch))
+
+    for entry, job in entries:
+        # 64 caracteres de margen para la cabecera
+        if batch and sum(len(line) + 2 for line in lines) + len(entry) + 64 > 4096:
+            close()
+            lines, batch = [], []
+        lines.append(entry)
+        batch.append(job)
+    if batch:
+        close()
+    return messages
+
+
+async def _flush_periodically(batch: PublishBatch, digest: Digest):
+    while True:
+        await asyncio.sleep(DIGEST_FLUSH_SECONDS)
+        try:
+            await batch.flush()
+            await digest.flush()
+        except Exception as e:
+            logger.error(f"  Error vaciando el resumen: {e}")
+
+
+async def check_and_publish(bot, deep: bool = False, categories=None) -> dict:
+    """
+    Ciclo completo como pipeline por etapas:
+    listados → descarga/limpieza → Telegraph → Telegram.
+    Las categorías se recorren en paralelo y cada etapa tiene su propia concurrencia.
+    Con `deep=True` se ignora la marca incremental y se recorren todas las páginas.
+    `categories` limita el recorrido a esas categorías (por defecto, todas).
+    No se llama directamente: lo lanza el planificador (request_cycle), que
+    garantiza un único ciclo a la vez.
+
+    Devuelve, por categoría revisada, el número de relatos nuevos encontrados
+    o la excepción que impidió revisarla.
+    """
+    categories = [cat_id for cat_id in CATEGORIES if categories is None or cat_id in categories]
+    started = asyncio.get_running_loop().time()
+    _health["cycle_started_at"] = time.time()
+    story_q = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    publish_q = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    notify_q = asyncio.Queue()
+    new_counts = {cat_id: 0 for cat_id in CATEGORIES}
+    queued = set()
+
+    # Modo resumen: registros en lote y un aviso por categoría en vez de uno por relato
+    batch = PublishBatch(notify_q) if DIGEST_MODE else None
+    digest = Digest(bot) if DIGEST_MODE else None
+
+    workers = [asyncio.create_task(fetch_stage(story_q, publish_q)) for _ in range(FETCH_WORKERS)]
+    workers += [asyncio.create_task(publish_stage(publish_q, notify_q, new_counts, batch))
+                for _ in range(PUBLISH_WORKERS)]
+    workers.append(asyncio.create_task(notify_stage(bot, notify_q, digest)))
+    if DIGEST_MODE:
+        workers.append(asyncio.create_task(_flush_periodically(batch, digest)))
 
-    return [url1, url2]
+    try:
+        await resume_jobs({"discovered": story_q, "fetched": publish_q, "published": notify_q}, queued, deep)
+        results = await asyncio.gather(
+            *(discover_stage(cat_id, CATEGORIES[cat_id], story_q, queued, deep) for cat_id in categories),
+            return_exceptions=True,
+        )
+        for cat_id, result in zip(categories, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error revisando {CATEGORIES[cat_id]['name']}: {result}")
+        await story_q.join()
+        await publish_q.join()
+        if batch:
+            await batch.flush()
+        await notify_q.join()
+        if digest:
+            await digest.flush()
+    except Exception as e:
+        _health["last_error_at"] = time.time()
+        _health["last_error"] = f"{type(e).__name__}: {e}"
+        metrics.inc("relatos_errors_total", stage="cycle")
+        raise
+    finally:
+        _health["cycle_started_at"] = None
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await flush_index(bot)
+    _health["last_success_at"] = time.time()
+
+    for cat_id in categories:
+        logger.info(f"  {new_counts[cat_id]} nuevos en {CATEGORIES[cat_id]['name']}")
+    elapsed = asyncio.get_running_loop().time() - started
+    metrics.observe("relatos_cycle_seconds", elapsed)
+    metrics.inc("relatos_cycles_total")
+    logger.info(f"Revisión completada en {elapsed:.0f}s. Total nuevos: {sum(new_counts.values())}")
+    return dict(zip(categories, results))
 
 
 # ══════════════════════════════════════════════
-# LÓGICA PRINCIPAL
+# PLANIFICADOR
+# ══════════════════════════════════════════════
+#
+# Garantiza un único ciclo a la vez. Las peticiones (tick periódico, /check,
+# /backfill) que llegan durante un ciclo se fusionan con él si ya están
+# cubiertas, o se acumulan en un único ciclo pendiente que se lanza al terminar.
+#
+# Cada categoría tiene su propio intervalo de revisión, guardado en `config`:
+# se estima la tasa de relatos nuevos por hora (media móvil exponencial) y el
+# intervalo es el tiempo esperado hasta el siguiente relato, acotado entre
+# POLL_MIN_HOURS y POLL_MAX_HOURS.
+
+POLL_RATE_ALPHA = 0.3
+
+_cycle = {"task": None, "running": None, "pending": None}
+_schedule = {}
+
+
+def get_schedule(cat_id: str) -> dict:
+    if cat_id not in _schedule:
+        _schedule[cat_id] = get_config(f"schedule_{cat_id}") or {
+            "interval": INTERVAL_HOURS * 3600, "rate": None, "last_at": None, "next_at": None,
+        }
+    return _schedule[cat_id]
+
+
+def shortest_poll_interval() -> float:
+    """Intervalo de revisión más corto entre las categorías (segundos)."""
+    # Copia: se llama desde el hilo del health check mientras get_schedule
+    # (en un hilo de asyncio.to_thread) puede estar añadiendo categorías
+    entries = list(_schedule.values())
+    if not entries:
+        return INTERVAL_HOURS * 3600
+    return min(entry["interval"] for entry in entries)
+
+
+def due_categories(now: datetime) -> list:
+    return [cat_id for cat_id in CATEGORIES
+            if not get_schedule(cat_id)["next_at"] or get_schedule(cat_id)["next_at"] <= now]
+
+
+def update_schedule(cat_id: str, result, deep: bool, now: datetime):
+    """Ajusta el intervalo de la categoría según los relatos nuevos encontrados."""
+    entry = get_schedule(cat_id)
+    if isinstance(result, Exception):
+        # Reintentar pronto, sin tocar la tasa estimada
+        entry["next_at"] = now + timedelta(hours=POLL_MIN_HOURS)
+    else:
+        # El primer ciclo y los backfill encuentran relatos antiguos: no dicen nada de la frecuencia
+        if entry["last_at"] and not deep:
+            hours = max((now - entry["last_at"]).total_seconds() / 3600, POLL_MIN_HOURS)
+            sample = result / hours
+            rate = sample if entry["rate"] is None else (
+                POLL_RATE_ALPHA * sample + (1 - POLL_RATE_ALPHA) * entry["rate"])
+            entry["rate"] = rate
+            expected = 1 / rate if rate > 0 else POLL_MAX_HOURS
+            entry["interval"] = min(max(expected, POLL_MIN_HOURS), POLL_MAX_HOURS) * 3600
+        entry["last_at"] = now
+        entry["next_at"] = now + timedelta(seconds=entry["interval"])
+    set_config(f"schedule_{cat_id}", entry)
+
+
+def request_cycle(bot, categories=None, deep: bool = False) -> str:
+    """
+    Pide un ciclo. Devuelve "started" si se lanza ahora, "coalesced" si el
+    ciclo en curso ya cubre la petición y "queued" si se hará al terminar este.
+    """
+    wanted = {"categories": set(categories or CATEGORIES), "deep": deep}
+    running = _cycle["running"]
+    if running and wanted["categories"] <= running["categories"] and (running["deep"] or not deep):
+        return "coalesced"
+    pending = _cycle["pending"]
+    if pending:
+        pending["categories"] |= wanted["categories"]
+        pending["deep"] = pending["deep"] or deep
+    else:
+        _cycle["pending"] = wanted
+    if _cycle["task"] is None or _cycle["task"].done():
+        _cycle["task"] = asyncio.create_task(_run_cycles(bot))
+        return "started"
+    return "queued"
+
+
+async def _run_cycles(bot):
+    while _cycle["pending"]:
+        run = _cycle["running"] = _cycle["pending"]
+        _cycle["pending"] = None
+        try:
+            results = await check_and_publish(bot, deep=run["deep"], categories=run["categories"])
+            now = datetime.now()
+            for cat_id, result in results.items():
+                await asyncio.to_thread(update_schedule, cat_id, result, run["deep"], now)
+        except Exception as e:
+            logger.error(f"Error en el ciclo de revisión: {e}")
+        finally:
+            _cycle["running"] = None
+
+
+async def scheduler_tick(context: ContextTypes.DEFAULT_TYPE):
+    """Job periódico: lanza un ciclo con las categorías a las que les toca revisión."""
+    due = await asyncio.to_thread(due_categories, datetime.now())
+    if due:
+        request_cycle(context.bot, due)
+
+
 # ══════════════════════════════════════════════
+# MANTENIMIENTO EN SEGUNDO PLANO
+# ══════════════════════════════════════════════
+#
+# /fix_titles y /fix_categories recorren `published` por lotes ordenados por
+# _id (sin cargar toda la colección), procesan cada lote con concurrencia
+# limitada y escriben con bulk_write. Tras cada lote se guarda un checkpoint
+# en `maintenance`, así que una tarea interrumpida se reanuda al arrancar.
+
+_maintenance_tasks = {}
 
-async def check_and_publish(context: ContextTypes.DEFAULT_TYPE):
-    total_new = 0
 
+def _assign_category(url: str) -> str:
+    # Mapeo URL -> category id
     for cat_id, cat in CATEGORIES.items():
-        logger.info(f"Revisando categoría: {cat['name']}")
-        stories = get_all_story_links(cat["url"])
-        logger.info(f"  Encontrados: {len(stories)} relatos")
-        new_count = 0
+        cat_slug = cat["url"].split("/category/")[1].rstrip("/")
+        if cat_slug in url:
+            return cat_id
+    # Si no se detecta por URL, intentar por las URLs de categoría conocidas
+    for cat_id, cat in CATEGORIES.items():
+        if cat["url"].split("/")[2] in url:
+            return cat_id
+    # Default: gays (los primeros relatos publicados eran de esa categoría)
+    return "gays"
 
-        for story in stories:
-            url = story["url"]
-            title = story["title"]
 
-            if is_published(url):
-                continue
+async def _fix_categories_batch(stories: list, stats: dict) -> list:
+    ops = []
+    for story in stories:
+        ops.append(UpdateOne({"_id": story["_id"]}, {"$set": {"category": _assign_category(story.get("url", ""))}}))
+        stats["updated"] += 1
+    return ops
 
-            logger.info(f"  Nuevo: {title}")
-            content, pub_date, real_title = get_story_content(url)
-            if not content:
-                continue
 
-            # Usar el título real de la página si está disponible
-            if real_title:
-                logger.info(f"  Título original: {real_title}")
-                title = real_title
+async def _fix_title_one(story: dict, stats: dict) -> UpdateOne | None:
+    url = story.get("url", "")
+    old_title = story.get("title", "")
+    if not url:
+        stats["skipped"] += 1
+        return None
+    try:
+        # Ante un 304 se parsea la copia en caché: la extracción del título
+        # puede haber cambiado aunque la página no (y ese es el motivo de /fix_titles)
+        page = await fetch_page(url, encoding="utf-8")
+        real_title = await run_parser(extract_title, page.body, page.encoding)
+    except Exception as e:
+        logger.error("Error actualizando titulo de " + url + ": " + str(e))
+        stats["failed"] += 1
+        return None
 
-            try:
-                urls = publish_to_telegraph(title, content)
-                telegraph_url = urls[0]
-                mark_published(url, title, telegraph_url, pub_date, cat_id)
-                new_count += 1
-                total_new += 1
+    if real_title and real_title != old_title:
+        stats["updated"] += 1
+        logger.info("'" + old_title + "' -> '" + real_title + "'")
+        return UpdateOne({"_id": story["_id"]}, {"$set": {"title": real_title}})
+    stats["skipped"] += 1
+    return None
 
-                date_line = f"📅 <i>{pub_date}</i>\n\n" if pub_date else ""
-                cat_line = f"📂 <i>{cat['name']}</i>\n\n"
 
-                if len(urls) == 1:
-                    links = f'🔗 <a href="{urls[0]}">Leer en Telegraph</a>'
-                else:
-                    links = f'🔗 <a href="{urls[0]}">Parte 1</a> | <a href="{urls[1]}">Parte 2</a>'
+async def _fix_titles_batch(stories: list, stats: dict) -> list:
+    semaphore = asyncio.Semaphore(MAINTENANCE_CONCURRENCY)
 
-                message = f"📖 <b>{title}</b>\n\n{cat_line}{date_line}{links}"
-                await context.bot.send_message(
-                    chat_id=CHAT_ID, text=message, parse_mode="HTML",
-                )
-                logger.info(f"  Publicado: {telegraph_url}")
-                await update_index(context.bot)
-                await asyncio.sleep(3)
+    async def one(story):
+        async with semaphore:
+            return await _fix_title_one(story, stats)
 
-            except Exception as e:
-                error_str = str(e)
-                logger.error(f"  Error publicando '{title}': {error_str}")
-                # Si Telegraph pide esperar, respetar el tiempo y detener el ciclo
-                if "FLOOD_WAIT" in error_str:
-                    try:
-                        wait_seconds = int(error_str.split("FLOOD_WAIT_")[1].split()[0])
-                    except Exception:
-                        wait_seconds = 60
-                    logger.warning(f"  Telegraph flood wait: {wait_seconds}s. Pausando ciclo.")
-                    await asyncio.sleep(min(wait_seconds, 3600))
-                    break  # salir del loop de esta categoría y continuar en el siguiente ciclo
+    results = await asyncio.gather(*(one(story) for story in stories))
+    return [op for op in results if op is not None]
+
+
+async def _reindex_one(story: dict, stats: dict) -> tuple:
+    """(operación sobre fingerprints, operación sobre published) de un relato, o (None, None)."""
+    try:
+        page = await fetch_page(story["url"], encoding="utf-8")
+        analysis = await run_parser(analyze_story, page.body, page.encoding)
+    except Exception as e:
+        logger.error(f"Error reindexando {story['url']}: {e}")
+        stats["failed"] += 1
+        return None, None
+    if not analysis.keywords and not analysis.fingerprint:
+        stats["skipped"] += 1
+        return None, None
+    stats["updated"] += 1
+    fingerprint_op = None
+    if analysis.fingerprint:
+        fingerprint_op = UpdateOne(
+            {"url": story["url"]}, {"$set": _fingerprint_doc(story["url"], analysis.fingerprint)}, upsert=True)
+    return fingerprint_op, UpdateOne({"_id": story["_id"]}, {"$set": {"search_text": analysis.keywords}})
+
+
+async def _reindex_batch(stories: list, stats: dict) -> list:
+    """
+    Huellas y palabras clave de relatos publicados antes de que existieran.
+    Las huellas se escriben aquí; las palabras clave las escribe el runner.
+    """
+    semaphore = asyncio.Semaphore(MAINTENANCE_CONCURRENCY)
+
+    async def one(story):
+        async with semaphore:
+            return await _reindex_one(story, stats)
+
+    results = await asyncio.gather(*(one(story) for story in stories))
+    fingerprint_ops = [op for op, _ in results if op is not None]
+    if fingerprint_ops:
+        await asyncio.to_thread(get_db().fingerprints.bulk_write, fingerprint_ops, ordered=False)
+    return [op for _, op in results if op is not None]
+
+
+MAINTENANCE_TASKS = {
+    "fix_titles": {
+        "label": "Corrección de títulos",
+        "query": {},
+        "projection": {"_id": 1, "url": 1, "title": 1},
+        "process": _fix_titles_batch,
+    },
+    "fix_categories": {
+        "label": "Corrección de categorías",
+        "query": {"$or": [{"category": {"$exists": False}}, {"category": ""}, {"category": None}]},
+        "projection": {"_id": 1, "url": 1},
+        "process": _fix_categories_batch,
+    },
+    "reindex": {
+        "label": "Reindexación (huellas y búsqueda)",
+        "query": {"duplicate_of": {"$exists": False}},
+        "projection": {"_id": 1, "url": 1},
+        "process": _reindex_batch,
+    },
+}
+
+
+def start_maintenance(bot, name: str, chat_id: int | str) -> bool:
+    """Lanza la tarea desde cero. Devuelve False si ya está en marcha."""
+    task = _maintenance_tasks.get(name)
+    if task and not task.done():
+        return False
+    # Se reserva antes del primer await para que dos comandos seguidos no lancen dos tareas
+    _maintenance_tasks[name] = asyncio.create_task(_start_maintenance(bot, name, chat_id))
+    return True
+
+
+async def _start_maintenance(bot, name: str, chat_id: int | str):
+    await asyncio.to_thread(get_db().maintenance.replace_one, {"_id": name}, {
+        "_id": name, "state": "running", "last_id": None, "chat_id": chat_id,
+        "processed": 0, "updated": 0, "skipped": 0, "failed": 0,
+        "started": datetime.now(), "finished": None,
+    }, upsert=True)
+    await run_maintenance(bot, name)
+
+
+async def resume_maintenance(bot):
+    """Reanuda las tareas que quedaron en marcha antes de un reinicio."""
+    checkpoints = await asyncio.to_thread(lambda: list(get_db().maintenance.find({"state": "running"})))
+    for checkpoint in checkpoints:
+        name = checkpoint["_id"]
+        if name in MAINTENANCE_TASKS:
+            logger.info(f"Reanudando mantenimiento '{name}' ({checkpoint['processed']} procesados).")
+            _maintenance_tasks[name] = asyncio.create_task(run_maintenance(bot, name))
+
+
+def _next_maintenance_batch(name: str, last_id) -> list:
+    task = MAINTENANCE_TASKS[name]
+    query = dict(task["query"])
+    if last_id is not None:
+        query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+    cursor = get_db().published.find(query, task["projection"]).sort("_id", ASCENDING).limit(MAINTENANCE_BATCH)
+    return list(cursor)
+
+
+def _save_maintenance_batch(name: str, ops: list, last_id, stats: dict, processed: int):
+    db = get_db()
+    if ops:
+        db.published.bulk_write(ops, ordered=False)
+    db.maintenance.update_one(
+        {"_id": name},
+        {"$set": {"last_id": last_id, "updated_at": datetime.now(), **stats}, "$inc": {"processed": processed}},
+    )
+
+
+async def run_maintenance(bot, name: str):
+    task = MAINTENANCE_TASKS[name]
+    checkpoint = await asyncio.to_thread(get_db().maintenance.find_one, {"_id": name})
+    last_id = checkpoint.get("last_id")
+    stats = {key: checkpoint.get(key, 0) for key in ("updated", "skipped", "failed")}
+    try:
+        while True:
+            batch = await asyncio.to_thread(_next_maintenance_batch, name, last_id)
+            if not batch:
+                break
+            ops = await task["process"](batch, stats)
+            last_id = batch[-1]["_id"]
+            await asyncio.to_thread(_save_maintenance_batch, name, ops, last_id, dict(stats), len(batch))
+    except Exception as e:
+        logger.error(f"Error en mantenimiento '{name}': {e}")
+        await asyncio.to_thread(
+            get_db().maintenance.update_one, {"_id": name}, {"$set": {"state": "failed", "error": str(e)}})
+        return
+
+    await asyncio.to_thread(
+        get_db().maintenance.update_one, {"_id": name}, {"$set": {"state": "done", "finished": datetime.now()}})
+    logger.info(f"Mantenimiento '{name}' completado: {stats}")
+    invalidate_category_counts()
+    invalidate_latest()
+    try:
+        await bot.send_message(
+            chat_id=checkpoint["chat_id"],
+            text=f"<b>{task['label']}: listo.</b>\nActualizados: <b>{stats['updated']}</b>\n"
+                 f"Sin cambios: <b>{stats['skipped']}</b>\nErrores: <b>{stats['failed']}</b>",
+            parse_mode="HTML",
+        )
+    except Exception as e:
+        logger.warning(f"No se pudo avisar del fin de '{name}': {e}")
+    if stats["updated"]:
+        await update_index(bot)
 
-        logger.info(f"  {new_count} nuevos en {cat['name']}")
 
-    logger.info(f"Revisión completada. Total nuevos: {total_new}")
+def build_jobs_report() -> str:
+    """Estado de las tareas de mantenimiento y de la cola de publicación (para /jobs)."""
+    db = get_db()
+    lines = ["🛠 <b>Tareas</b>\n"]
+    for name, task in MAINTENANCE_TASKS.items():
+        checkpoint = db.maintenance.find_one({"_id": name})
+        if not checkpoint:
+            lines.append(f"{task['label']}: <i>nunca ejecutada</i>")
+            continue
+        state = {"running": "⏳ en marcha", "done": "✅ terminada", "failed": "❌ fallida"}.get(checkpoint["state"], checkpoint["state"])
+        lines.append(
+            f"{task['label']}: {state}\n"
+            f"  procesados {checkpoint['processed']} · actualizados {checkpoint['updated']} · "
+            f"sin cambios {checkpoint['skipped']} · errores {checkpoint['failed']}"
+        )
+
+    counts = {doc["_id"]: doc["count"] for doc in db.jobs.aggregate([{"$group": {"_id": "$state", "count": {"$sum": 1}}}])}
+    lines.append("\n📬 <b>Cola de publicación</b>")
+    for state in JOB_STATES + ("failed",):
+        lines.append(f"  {state}: <b>{counts.get(state, 0)}</b>")
+    return "\n".join(lines)
 
 
 # ══════════════════════════════════════════════
@@ -484,28 +2548,71 @@ async def cmd_start(update, context: ContextTypes.DEFAULT_TYPE):
     cats = "\n".join(f"  • {c['name']}" for c in CATEGORIES.values())
     await update.message.reply_text(
         f"👋 Bot activo.\n\n"
-        f"⏰ Reviso cada <b>{INTERVAL_HOURS} horas</b>\n"
+        f"⏰ Reviso cada categoría cada <b>{POLL_MIN_HOURS:g}–{POLL_MAX_HOURS:g} horas</b> según su actividad\n"
         f"📄 Hasta <b>{MAX_PAGES} páginas</b> por categoría\n\n"
         f"📂 Categorías:\n{cats}\n\n"
         f"📌 Comandos:\n"
         f"• /check — revisar ahora\n"
+        f"• /backfill — revisar todas las páginas\n"
         f"• /status — estadísticas\n"
+        f"• /buscar — buscar relatos\n"
         f"• /indice — mostrar índice\n"
-        f"• /fix_titles — corregir títulos",
+        f"• /fix_titles — corregir títulos\n"
+        f"• /jobs — tareas en segundo plano\n"
+        f"• /stats — latencias por etapa",
         parse_mode="HTML",
     )
 
+CYCLE_REPLIES = {
+    "started": "🔍 Revisando {what}...",
+    "coalesced": "⏳ Ya hay una revisión en curso que incluye {what}.",
+    "queued": "⏳ Hay una revisión en curso; revisaré {what} en cuanto termine.",
+}
+
 async def cmd_check(update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🔍 Revisando todas las categorías...")
-    await check_and_publish(context)
+    status = request_cycle(context.bot)
+    await update.message.reply_text(CYCLE_REPLIES[status].format(what="todas las categorías"))
 
-async def cmd_status(update, context: ContextTypes.DEFAULT_TYPE):
+async def cmd_backfill(update, context: ContextTypes.DEFAULT_TYPE):
+    status = request_cycle(context.bot, deep=True)
+    await update.message.reply_text(
+        CYCLE_REPLIES[status].format(what=f"las {MAX_PAGES} páginas de todas las categorías"))
+
+def status_text() -> str:
     lines = ["📊 <b>Relatos publicados</b>\n"]
     for cat_id, cat in CATEGORIES.items():
         count = count_by_category(cat_id)
-        lines.append(f"{cat['name']}: <b>{count}</b>")
+        schedule = get_schedule(cat_id)
+        next_at = schedule["next_at"].strftime("%d/%m %H:%M") if schedule["next_at"] else "pendiente"
+        lines.append(
+            f"{cat['name']}: <b>{count}</b> · cada {schedule['interval'] / 3600:.1f}h · próxima {next_at}")
     lines.append(f"\n<b>Total: {count_published()}</b>")
-    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+    return "\n".join(lines)
+
+async def cmd_status(update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(await asyncio.to_thread(status_text), parse_mode="HTML")
+
+async def cmd_buscar(update, context: ContextTypes.DEFAULT_TYPE):
+    terms = " ".join(context.args).strip()
+    if not terms:
+        await update.message.reply_text("Uso: /buscar <palabras>  (p. ej. /buscar noche de verano)")
+        return
+    try:
+        text, keyboard = await asyncio.to_thread(build_search_page, terms, 0)
+    except Exception as e:
+        logger.error(f"Error buscando '{terms}': {e}")
+        text, keyboard = "❌ Error en la búsqueda.", None
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=keyboard, disable_web_page_preview=True)
+
+async def cmd_stats(update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(build_stats_report(), parse_mode="HTML")
+
+async def cmd_db_status(update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        report = await asyncio.to_thread(build_db_report)
+    except Exception as e:
+        report = f"❌ Error consultando MongoDB: {e}"
+    await update.message.reply_text(report, parse_mode="HTML")
 
 async def cmd_indice(update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("📚 Actualizando índice...")
@@ -516,155 +2623,110 @@ async def cmd_indice(update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_fix_categories(update, context: ContextTypes.DEFAULT_TYPE):
     """Asigna categoria correcta a relatos que no la tienen, basandose en su URL."""
-    db = get_db()
-
-    # Mapeo URL -> category id
-    url_to_cat = {v["url"].split("/category/")[1].rstrip("/"): k for k, v in CATEGORIES.items()}
-
-    stories = list(db.published.find(
-        {"$or": [{"category": {"$exists": False}}, {"category": ""}, {"category": None}]},
-        {"_id": 1, "url": 1, "category": 1}
-    ))
-
-    await update.message.reply_text(
-        "<b>" + str(len(stories)) + " relatos sin categoría.</b> Corrigiendo...",
-        parse_mode="HTML",
-    )
+    await start_maintenance_command(update, context, "fix_categories")
 
-    fixed = 0
-    for story in stories:
-        url = story.get("url", "")
-        assigned = None
-        for cat_slug, cat_id in url_to_cat.items():
-            if cat_slug in url:
-                assigned = cat_id
-                break
-        # Si no se detecta por URL, intentar por las URLs de categoría conocidas
-        if not assigned:
-            for cat_id, cat in CATEGORIES.items():
-                cat_domain = cat["url"].split("/")[2]
-                if cat_domain in url:
-                    assigned = cat_id
-                    break
-        # Default: gays (los primeros relatos publicados eran de esa categoría)
-        if not assigned:
-            assigned = "gays"
 
-        db.published.update_one(
-            {"_id": story["_id"]},
-            {"$set": {"category": assigned}}
-        )
-        fixed += 1
+async def cmd_fix_titles(update, context: ContextTypes.DEFAULT_TYPE):
+    await start_maintenance_command(update, context, "fix_titles")
 
-    await update.message.reply_text(
-        "<b>Listo.</b> " + str(fixed) + " relatos actualizados.",
-        parse_mode="HTML",
-    )
-    await update_index(context.bot)
 
+async def cmd_reindex(update, context: ContextTypes.DEFAULT_TYPE):
+    await start_maintenance_command(update, context, "reindex")
 
-async def cmd_fix_titles(update, context: ContextTypes.DEFAULT_TYPE):
-    db = get_db()
-    stories = list(db.published.find({}, {"_id": 1, "url": 1, "title": 1}))
-    total = len(stories)
-    updated = 0
-    failed = 0
-    skipped = 0
 
+async def start_maintenance_command(update, context: ContextTypes.DEFAULT_TYPE, name: str):
+    label = MAINTENANCE_TASKS[name]["label"]
+    if not start_maintenance(context.bot, name, update.effective_chat.id):
+        await update.message.reply_text(f"⏳ {label} ya está en marcha. Consulta /jobs.")
+        return
     await update.message.reply_text(
-        "<b>Actualizando títulos de " + str(total) + " relatos...</b>\n<i>Esto puede tardar varios minutos.</i>",
+        f"<b>{label} iniciada en segundo plano.</b>\n<i>Progreso con /jobs.</i>",
         parse_mode="HTML",
     )
 
-    for i, story in enumerate(stories, 1):
-        url = story.get("url", "")
-        old_title = story.get("title", "")
-        if not url:
-            skipped += 1
-            continue
-
-        try:
-            resp = requests.get(url, headers=HEADERS, timeout=15)
-            resp.raise_for_status()
-            resp.encoding = "utf-8"
-            soup = BeautifulSoup(resp.text, "html.parser")
-
-            real_title = ""
-            for selector in [".entry-title", "h1.post-title", "h1", "title"]:
-                el = soup.select_one(selector)
-                if el:
-                    real_title = el.get_text(strip=True)
-                    for sep in [" \u2013 ", " | ", " - "]:
-                        if sep in real_title:
-                            real_title = real_title.split(sep)[0].strip()
-                    if real_title:
-                        break
-
-            if real_title and real_title != old_title:
-                db.published.update_one(
-                    {"_id": story["_id"]},
-                    {"$set": {"title": real_title}}
-                )
-                updated += 1
-                logger.info("[" + str(i) + "/" + str(total) + "] '" + old_title + "' -> '" + real_title + "'")
-            else:
-                skipped += 1
 
-            if i % 20 == 0:
-                await update.message.reply_text(
-                    "Progreso: " + str(i) + "/" + str(total) + " revisados, " + str(updated) + " actualizados...",
-                )
+async def cmd_jobs(update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        report = await asyncio.to_thread(build_jobs_report)
+    except Exception as e:
+        report = f"❌ Error consultando MongoDB: {e}"
+    await update.message.reply_text(report, parse_mode="HTML")
 
-            await asyncio.sleep(1)
 
-        except Exception as e:
-            logger.error("Error actualizando titulo de " + url + ": " + str(e))
-            failed += 1
+# ══════════════════════════════════════════════
+# ARRANQUE
+# ══════════════════════════════════════════════
 
-    await update.message.reply_text(
-        "<b>Listo.</b>\nActualizados: <b>" + str(updated) + "</b>\nSin cambios: <b>" + str(skipped) + "</b>\nErrores: <b>" + str(failed) + "</b>",
-        parse_mode="HTML",
-    )
+async def on_startup(app: Application):
+    ensure_indexes()
+    get_published_urls()
+    get_category_counts()
+    for cat_id in CATEGORIES:
+        get_category_page(cat_id)
+    await resume_maintenance(app.bot)
+    _health["loop"] = asyncio.get_running_loop()
+    _health["polling"] = "running"
 
-    if updated > 0:
-        await update_index(context.bot)
 
+async def on_shutdown(app: Application):
+    _health["polling"] = "stopped"
+    await close_http()
+    close_parse_pool()
 
-# ══════════════════════════════════════════════
-# ARRANQUE
-# ══════════════════════════════════════════════
 
 def main():
-    start_health_server()
-
-    app = (
+    builder = (
         Application.builder()
         .token(TELEGRAM_TOKEN)
-        .get_updates_read_timeout(30)
-        .get_updates_write_timeout(30)
-        .get_updates_connect_timeout(30)
-        .get_updates_pool_timeout(30)
-        .build()
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
+    if WEBHOOK_URL:
+        # Sin Updater: los updates llegan por WebhookServer a app.update_queue
+        app = builder.updater(None).concurrent_updates(WEBHOOK_CONCURRENCY).build()
+    else:
+        start_health_server()
+        app = (
+            builder
+            .get_updates_read_timeout(30)
+            .get_updates_write_timeout(30)
+            .get_updates_connect_timeout(30)
+            .get_updates_pool_timeout(30)
+            .build()
+        )
 
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("check", cmd_check))
+    app.add_handler(CommandHandler("backfill", cmd_backfill))
     app.add_handler(CommandHandler("status", cmd_status))
     app.add_handler(CommandHandler("indice", cmd_indice))
+    app.add_handler(CommandHandler("db_status", cmd_db_status))
+    app.add_handler(CommandHandler("stats", cmd_stats))
     app.add_handler(CommandHandler("fix_categories", cmd_fix_categories))
     app.add_handler(CommandHandler("fix_titles", cmd_fix_titles))
+    app.add_handler(CommandHandler("reindex", cmd_reindex))
+    app.add_handler(CommandHandler("buscar", cmd_buscar))
+    app.add_handler(CommandHandler("jobs", cmd_jobs))
     app.add_handler(CallbackQueryHandler(callback_category, pattern="^cat_"))
+    app.add_handler(CallbackQueryHandler(callback_search, pattern="^busk?_"))
 
     app.job_queue.run_repeating(
-        check_and_publish,
-        interval=INTERVAL_HOURS * 3600,
+        scheduler_tick,
+        interval=SCHEDULER_TICK_SECONDS,
         first=10,
     )
 
-    logger.info(f"Bot iniciado. {len(CATEGORIES)} categorías. Revisando cada {INTERVAL_HOURS}h.")
+    logger.info(
+        f"Bot iniciado. {len(CATEGORIES)} categorías. "
+        f"Revisando cada {POLL_MIN_HOURS:g}–{POLL_MAX_HOURS:g}h según la actividad de cada una."
+    )
+
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+        _health["polling"] = "stopped"
+        return
 
-    import time
-    from telegram.error import Conflict, NetworkError
+    from telegram.error import Conflict
 
     max_retries = 10
     for attempt in range(max_retries):
@@ -672,15 +2734,19 @@ def main():
             app.run_polling(drop_pending_updates=True)
             break
         except Conflict:
+            _health["polling"] = "restarting"
             wait = 15 * (attempt + 1)
             logger.warning(f"Conflict: otra instancia activa. Esperando {wait}s (intento {attempt+1}/{max_retries})...")
             time.sleep(wait)
         except NetworkError as e:
+            _health["polling"] = "restarting"
             logger.warning(f"NetworkError: {e}. Reintentando en 10s...")
             time.sleep(10)
         except Exception as e:
+            _health["polling"] = "restarting"
             logger.error(f"Error inesperado: {e}")
             time.sleep(10)
+    _health["polling"] = "stopped"
 
 
 if __name__ == "__main__":
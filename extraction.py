@@ -0,0 +1,308 @@
+"""
+Extracción de relatos a partir del HTML de una página de WordPress.
+
+Se parsea la página una sola vez y se obtienen juntos título, fecha y
+contenido (ya convertido en nodos de Telegraph). Los selectores se compilan
+al importar el módulo.
+
+También calcula, sobre el texto limpio, la huella (hash exacto + SimHash)
+con la que el bot detecta relatos reeditados con otra URL y las palabras
+clave que alimentan la búsqueda.
+
+Este módulo no depende de la configuración del bot, así que se puede usar
+desde benchmarks o procesos auxiliares.
+"""
+
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from typing import NamedTuple
+
+import soupsieve as sv
+from bs4 import BeautifulSoup, NavigableString, Tag
+from telegraph.utils import BLOCK_ELEMENTS, VOID_ELEMENTS, nodes_to_html
+
+PARSER = "lxml"
+
+TITLE_SELECTORS = [sv.compile(s) for s in (".entry-title", "h1.post-title", "h1", "title")]
+TIME_SELECTOR = sv.compile("time")
+DATE_SELECTORS = [sv.compile(s) for s in (".entry-date", ".post-date", ".published", ".date")]
+CONTENT_SELECTORS = [sv.compile(s) for s in (".entry-content", ".post-content", "article .content", "article")]
+TITLE_SEPARATORS = (" – ", " | ", " - ")
+
+NO_CONTENT = [{"tag": "p", "children": ["No se pudo extraer el contenido."]}]
+
+
+class Story(NamedTuple):
+    title: str
+    pub_date: str
+    content: list | None
+
+
+def parse_page(html: str | bytes, encoding: str | None = None) -> BeautifulSoup:
+    kwargs = {}
+    if isinstance(html, bytes):
+        kwargs["from_encoding"] = encoding
+    return BeautifulSoup(html, PARSER, **kwargs)
+
+
+def extract_story(html: str | bytes, encoding: str | None = None, with_content: bool = True) -> Story:
+    """
+    Título, fecha y contenido (nodos de Telegraph) de una página de relato.
+    Con `with_content=False` no se busca ni limpia el contenido.
+    """
+    return _extract(parse_page(html, encoding), with_content)
+
+
+def analyze_story(html: str | bytes, encoding: str | None = None) -> "StoryAnalysis":
+    """
+    extract_story + huella + palabras clave para la búsqueda, en una sola
+    llamada (es lo que ejecuta el pool de procesos del bot).
+    """
+    story = extract_story(html, encoding)
+    words = text_words(story.content)
+    return StoryAnalysis(story, _fingerprint_words(words), search_keywords(words))
+
+
+def extract_title(html: str | bytes, encoding: str | None = None) -> str:
+    return extract_story(html, encoding, with_content=False).title
+
+
+def _extract(soup: BeautifulSoup, with_content: bool) -> Story:
+    """Aplica los selectores al árbol."""
+    pub_date = extract_pub_date(soup)
+    content_el = _select_first(soup, CONTENT_SELECTORS) if with_content else None
+    content = None
+    if with_content:
+        content = clean_nodes_for_telegraph(content_el) if content_el is not None else NO_CONTENT
+    return Story(extract_page_title(soup), pub_date, content)
+
+
+def _select_first(soup: BeautifulSoup, selectors: list):
+    for selector in selectors:
+        el = selector.select_one(soup)
+        if el is not None:
+            return el
+    return None
+
+
+def extract_page_title(soup: BeautifulSoup) -> str:
+    for selector in TITLE_SELECTORS:
+        el = selector.select_one(soup)
+        if el:
+            title = clean_title(el.get_text(strip=True))
+            if title:
+                return title
+    return ""
+
+
+def clean_title(title: str) -> str:
+    """Quita sufijos típicos de WordPress como " – Nombre del Sitio"."""
+    for sep in TITLE_SEPARATORS:
+        if sep in title:
+            title = title.split(sep)[0].strip()
+    return title
+
+
+def extract_pub_date(soup: BeautifulSoup) -> str:
+    time_tag = TIME_SELECTOR.select_one(soup)
+    if time_tag:
+        dt = time_tag.get("datetime", "")
+        if dt:
+            try:
+                return datetime.fromisoformat(dt[:10]).strftime("%d/%m/%Y")
+            except Exception:
+                pass
+        text = time_tag.get_text(strip=True)
+        if text: return text
+    for selector in DATE_SELECTORS:
+        el = selector.select_one(soup)
+        if el: return el.get_text(strip=True)
+    return ""
+
+
+TELEGRAPH_ALLOWED_TAGS = {
+    "p", "br", "strong", "em", "b", "i", "a", "ul", "ol", "li",
+    "h3", "h4", "blockquote", "figure", "figcaption", "img",
+}
+DROPPED_TAGS = {"script", "style", "ins", "iframe", "form", "nav"}
+DROPPED_CLASSES = {"sharedaddy", "jp-relatedposts"}
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def clean_nodes_for_telegraph(content: Tag | str) -> list:
+    """
+    Convierte el contenido en nodos de Telegraph en un único recorrido del
+    árbol ya parseado: descarta scripts/anuncios, convierte div en p,
+    desenvuelve las etiquetas no permitidas, conserva solo href/src y
+    normaliza espacios igual que telegraph.utils.html_to_nodes.
+    """
+    if isinstance(content, str):
+        content = BeautifulSoup(content, "lxml")
+    nodes = []
+    _clean_node(content, nodes, [None])
+    return nodes
+
+
+def clean_html_for_telegraph(content: Tag | str) -> str:
+    return nodes_to_html(clean_nodes_for_telegraph(content))
+
+
+def _clean_node(node, children: list, last_text: list):
+    if isinstance(node, NavigableString):
+        # Comentarios, doctype, CDATA, etc. son subclases y se descartan
+        if type(node) is NavigableString:
+            _append_text(children, str(node), last_text)
+        return
+    if node.name in DROPPED_TAGS or DROPPED_CLASSES.intersection(node.get("class") or ()):
+        return
+    name = "p" if node.name == "div" else node.name
+    if name not in TELEGRAPH_ALLOWED_TAGS:
+        for child in node.children:
+            _clean_node(child, children, last_text)
+        return
+
+    if name in BLOCK_ELEMENTS:
+        last_text[0] = None
+    element = {"tag": name}
+    if name == "a" and node.get("href"):
+        element["attrs"] = {"href": node["href"]}
+    elif name == "img" and node.get("src"):
+        element["attrs"] = {"src": node["src"]}
+    children.append(element)
+    if name in VOID_ELEMENTS:
+        return
+    sub = []
+    for child in node.children:
+        _clean_node(child, sub, last_text)
+    if sub:
+        element["children"] = sub
+
+
+def _append_text(children: list, text: str, last_text: list):
+    text = WHITESPACE_RE.sub(" ", text)
+    if last_text[0] is None or last_text[0].endswith(" "):
+        text = text.lstrip(" ")
+    if not text:
+        last_text[0] = None
+        return
+    last_text[0] = text
+    if children and isinstance(children[-1], str):
+        children[-1] += text
+    else:
+        children.append(text)
+
+
+# ─────────────────────────────────────────────
+# HUELLAS DE CONTENIDO
+# ─────────────────────────────────────────────
+#
+# `exact` es el SHA-1 del texto normalizado (minúsculas, sin tildes ni
+# puntuación). `simhash` es un SimHash de 64 bits sobre trigramas de
+# palabras: dos textos casi iguales difieren en pocos bits. Para buscar
+# candidatos sin comparar con todo, el SimHash se parte en 4 bandas de 16
+# bits; dos huellas a distancia <= 3 comparten al menos una banda.
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+SHINGLE_SIZE = 3
+MIN_FINGERPRINT_WORDS = 50
+WORD_RE = re.compile(r"\w+")
+
+
+class Fingerprint(NamedTuple):
+    exact: str
+    simhash: int
+
+
+class StoryAnalysis(NamedTuple):
+    story: Story
+    fingerprint: Fingerprint | None
+    keywords: str
+
+
+def fold_text(text: str) -> str:
+    """Minúsculas y sin tildes ("Corazón" -> "corazon"); la ñ queda como n."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def node_text(nodes: list) -> str:
+    """Texto plano de una lista de nodos de Telegraph."""
+    parts = []
+    stack = list(reversed(nodes or []))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            parts.append(node)
+        else:
+            parts.append(" ")
+            stack.extend(reversed(node.get("children", ())))
+    return "".join(parts)
+
+
+def text_words(nodes: list) -> list:
+    """Palabras del texto normalizadas con fold_text."""
+    return WORD_RE.findall(fold_text(node_text(nodes)))
+
+
+def _fingerprint_words(words: list) -> Fingerprint | None:
+    """Huella del texto; None si es demasiado corto para ser fiable."""
+    if len(words) < MIN_FINGERPRINT_WORDS:
+        return None
+    exact = hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    size = SIMHASH_BITS // 8
+    blob = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=size).digest() for s in shingles)
+    # Cuántos trigramas tienen cada bit a 1, contando por valores de byte (en C)
+    # en lugar de recorrer los 64 bits de cada hash
+    half = len(shingles) / 2
+    simhash = 0
+    for position in range(size):
+        ones = [0] * 8
+        for value, count in Counter(blob[position::size]).items():
+            for bit in range(8):
+                if value >> bit & 1:
+                    ones[bit] += count
+        for bit in range(8):
+            if ones[bit] > half:
+                simhash |= 1 << ((size - 1 - position) * 8 + bit)
+    return Fingerprint(exact, simhash)
+
+
+def simhash_bands(simhash: int) -> list:
+    """Bandas de 16 bits, etiquetadas con su posición para que no se mezclen."""
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [(band << width) | (simhash >> (band * width) & mask) for band in range(SIMHASH_BANDS)]
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+# ─────────────────────────────────────────────
+# PALABRAS CLAVE PARA LA BÚSQUEDA
+# ─────────────────────────────────────────────
+#
+# No se guarda el texto completo de cada relato en MongoDB: basta con sus
+# SEARCH_KEYWORDS palabras más frecuentes (sin palabras vacías), que es lo
+# que indexa el índice de texto junto con el título.
+
+SEARCH_KEYWORDS = 200
+STOPWORDS = set(fold_text("""
+    a al algo algunos ante antes aquel aqui asi aun bien cada casi como con contra cual cuando
+    de del desde donde dos el ella ellas ellos en entre era eran es esa ese eso esta estaba
+    estaban estar este esto estos fue fueron ha habia han hasta hay la las le les lo los mas
+    me mi mis mientras muy nada ni no nos nosotros o otra otro para pero poco por porque que
+    quien se sea ser si sin sobre solo su sus tambien tan tanto te tenia tiene todo todos tu
+    tus un una uno unos y ya yo
+""").split())
+
+
+def search_keywords(words: list, limit: int = SEARCH_KEYWORDS) -> str:
+    """Palabras más frecuentes del texto (ya normalizadas), separadas por espacios."""
+    counts = Counter(w for w in words if len(w) > 2 and not w.isdigit() and w not in STOPWORDS)
+    return " ".join(word for word, _ in counts.most_common(limit))
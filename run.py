@@ -0,0 +1,13 @@
+"""
+Punto de entrada del bot: python run.py
+
+Es mínimo a propósito. El pool de parseo arranca sus procesos con "spawn"
+y cada uno vuelve a importar el script principal como __mp_main__; si ese
+script fuera bot.py, cada proceso cargaría el bot entero (telegram, pymongo,
+httpx, configuración, logging). Desde aquí solo importan extraction.py.
+"""
+
+if __name__ == "__main__":
+    import bot
+
+    bot.main()